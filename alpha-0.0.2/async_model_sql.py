@@ -0,0 +1,113 @@
+"""
+Асинхронный доступ к UserManager и AttributeManager для пакетных заданий
+и сервисов без интерфейса Qt.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from test_model_sql import DatabasePool, UserManager, AttributeManager
+
+
+class AsyncDatabase:
+    """
+    Ограниченный пул потоков поверх DatabasePool.
+    Чтения выполняются параллельно на соединениях только для чтения,
+    записи проходят по одной через единственное соединение для записи,
+    поэтому запросы не делят один Database.cursor и не упираются в SQLITE_BUSY.
+    """
+    def __init__(self, db_name: str = 'your_database.db', max_workers: int = 4, profile: str | dict = "performance"):
+        self.pool = DatabasePool(db_name, readers=max_workers, profile=profile)
+        # Отдельный поток для записи: в общем пуле его мог бы занять читатель, ждущий свободное соединение
+        self._read_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="async-db-read")
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="async-db-write")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    async def read(self, func, *args):
+        """Выполняет func(user_manager, attribute_manager, *args) на соединении для чтения."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._call, func, args, False)
+
+    async def write(self, func, *args):
+        """Как read, но на соединении для записи и не параллельно с другими записями."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_executor, self._call, func, args, True)
+
+    async def close(self):
+        # Ожидание очереди заданий блокирует поток, поэтому выполняется вне цикла событий
+        await asyncio.to_thread(self._shutdown)
+
+    def _shutdown(self):
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        self.pool.close()
+
+    def _call(self, func, args, write: bool):
+        with (self.pool.writer() if write else self.pool.reader()) as db:
+            return func(UserManager(db), AttributeManager(db), *args)
+
+
+class AsyncUserManager:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+
+    async def select_all(self) -> dict:
+        return await self.database.read(lambda user_manager, _: user_manager.select_all())
+
+    async def select_page(self, after_id: int = 0, limit: int = 1000) -> list[dict]:
+        return await self.database.read(lambda user_manager, _: user_manager.select_page(after_id, limit))
+
+    async def select_on_filter(self, attributes: dict) -> dict:
+        return await self.database.read(lambda user_manager, _: user_manager.select_on_filter(attributes))
+
+    async def select_ids_on_filter(self, attributes: dict) -> frozenset:
+        return await self.database.read(lambda user_manager, _: user_manager.select_ids_on_filter(attributes))
+
+    async def bulk_create_users(self, rows, chunk_size: int = 1000) -> list[int]:
+        return await self.database.write(lambda user_manager, _: user_manager.bulk_create_users(rows, chunk_size))
+
+    async def update_data_user(self, data: dict):
+        return await self.database.write(lambda user_manager, _: user_manager.update_data_user(data))
+
+    async def delete_user(self, user_id):
+        return await self.database.write(lambda user_manager, _: user_manager.delete_user(user_id))
+
+
+class AsyncAttributeManager:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+
+    async def names_all_attributes(self) -> list[str]:
+        return await self.database.read(lambda _, attribute_manager: attribute_manager.names_all_attributes())
+
+    async def create_attribute(self, attribute_key: str, attribute_value=None):
+        return await self.database.write(
+            lambda _, attribute_manager: attribute_manager.create_attribute(attribute_key, attribute_value))
+
+    async def delete_attribute(self, attribute_key: str):
+        return await self.database.write(lambda _, attribute_manager: attribute_manager.delete_attribute(attribute_key))
+
+    async def rename_attribute(self, attribute_key: str, new_attribute_key: str):
+        return await self.database.write(
+            lambda _, attribute_manager: attribute_manager.rename_attribute(attribute_key, new_attribute_key))
+
+
+async def main():
+    async with AsyncDatabase('your_database.db') as database:
+        user_manager = AsyncUserManager(database)
+        reports = [
+            {"Вес": {"min": 50, "max": 80}},
+            {"Рост": {"min": 150, "max": 180}},
+            {"Вес": {"min": 60, "max": 90}, "Рост": {"min": 160, "max": 190}},
+        ]
+        results = await asyncio.gather(*(user_manager.select_on_filter(report) for report in reports))
+        for report, users in zip(reports, results):
+            print(report, len(users))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+"""
+Замеры скорости основных запросов test_model_sql.
+
+Запуск: python bench_model_sql.py [количество_пользователей] [indexes|filters|attributes|excel|all]
+"""
+import os
+import sys
+import random
+import tempfile
+from time import perf_counter
+
+from test_model_sql import *
+
+ATTRIBUTES = ["Имя", "Вес", "Рост"]
+
+
+def fill_database(db: Database, count_users: int):
+    """Быстро заполняет базу случайными спортсменами напрямую через executemany."""
+    TableManager(db).create_tables()
+    db.cursor.executemany("INSERT INTO Users (id) VALUES (?);", [(user_id,) for user_id in range(1, count_users + 1)])
+    db.cursor.executemany("INSERT INTO Attributes (attribute_name) VALUES (?);", [(name,) for name in ATTRIBUTES])
+
+    rows = []
+    for user_id in range(1, count_users + 1):
+        weight = random.randint(50, 95)
+        height = random.randint(150, 190)
+        rows.append((user_id, "Имя", f"Спортсмен {user_id}", None))
+        rows.append((user_id, "Вес", str(weight), weight))
+        rows.append((user_id, "Рост", str(height), height))
+    db.cursor.executemany("INSERT INTO UserAttributes (user_id, attribute_key, attribute_value, attribute_num) VALUES (?, ?, ?, ?);", rows)
+    db.commit()
+
+
+def measure(name: str, func, repeat: int = 3):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {name:<30} {best * 1000:10.1f} ms")
+    return best
+
+
+def bench_queries(db: Database, count_users: int):
+    user_manager = UserManager(db)
+    filters = {
+        "Вес": {"min": 50, "max": 80},
+        "Рост": {"min": 150, "max": 180},
+    }
+    user_ids = random.sample(range(1, count_users + 1), min(100, count_users))
+
+    measure("select_all", user_manager.select_all)
+    # Кэш фильтров сбрасывается перед каждым замером, иначе повторы измеряют попадание в кэш
+    measure("select_on_filter", lambda: (db.filter_cache.clear(), user_manager.select_on_filter(filters)))
+    measure("select_on_filter (кэш)", lambda: user_manager.select_on_filter(filters))
+    measure("select_user x100", lambda: [user_manager.select_user(user_id) for user_id in user_ids])
+    measure("update_data_user x100", lambda: user_manager.update_data_user(
+        {user_id: {"Вес": str(random.randint(50, 95))} for user_id in user_ids}))
+
+
+def bench_indexes(count_users: int):
+    """Сравнивает запросы без индексов и с индексами TableManager."""
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = Database(path)
+    fill_database(db, count_users)
+    table_manager = TableManager(db)
+
+    print(f"Без индексов, кроме уникального (user_id, attribute_key) ({count_users} пользователей):")
+    table_manager.drop_indexes()
+    bench_queries(db, count_users)
+
+    print(f"С индексами ({count_users} пользователей):")
+    table_manager.create_indexes()
+    db.cursor.execute("ANALYZE;")
+    db.commit()
+    bench_queries(db, count_users)
+
+    db.close()
+    os.remove(path)
+
+
+def legacy_build_query(attributes: dict) -> tuple[str, list]:
+    """Прежний вариант фильтра: отдельный IN (SELECT ...) на каждое условие."""
+    sub_query = """
+    (SELECT u.id
+    FROM Users u
+    JOIN UserAttributes ua ON u.id = ua.user_id
+    WHERE (ua.attribute_key = ? AND CAST(ua.attribute_value AS INTEGER) >= ? AND CAST(ua.attribute_value AS INTEGER) <= ?))
+    """
+    params = []
+    for attribute, limits in attributes.items():
+        params.extend([attribute, limits["min"], limits["max"]])
+    where_clause = "AND u.id IN".join(sub_query for _ in attributes)
+    return f"SELECT u.id FROM Users u WHERE u.id IN {where_clause}", params
+
+
+def fill_numeric_attributes(db: Database, count_users: int, count_attributes: int):
+    """Заполняет базу count_users пользователями с count_attributes числовыми атрибутами."""
+    TableManager(db).create_tables()
+    names = [f"Атрибут {index}" for index in range(count_attributes)]
+    db.cursor.executemany("INSERT INTO Users (id) VALUES (?);", [(user_id,) for user_id in range(1, count_users + 1)])
+    db.cursor.executemany("INSERT INTO Attributes (attribute_name) VALUES (?);", [(name,) for name in names])
+    for name in names:
+        rows = []
+        for user_id in range(1, count_users + 1):
+            value = random.randint(0, 100)
+            rows.append((user_id, name, str(value), value))
+        db.cursor.executemany("INSERT INTO UserAttributes (user_id, attribute_key, attribute_value, attribute_num) VALUES (?, ?, ?, ?);", rows)
+    db.cursor.execute("ANALYZE;")
+    db.commit()
+    return names
+
+
+def bench_filters(count_users: int, count_attributes: int = 10):
+    """Фильтр по 1-10 условиям: прежние вложенные IN против GROUP BY ... HAVING."""
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = Database(path)
+    names = fill_numeric_attributes(db, count_users, count_attributes)
+    user_manager = UserManager(db)
+
+    print(f"Фильтры ({count_users * count_attributes} строк UserAttributes):")
+    for count_conditions in range(1, count_attributes + 1):
+        attributes = {name: {"min": 10, "max": 90} for name in names[:count_conditions]}
+        legacy_query, legacy_params = legacy_build_query(attributes)
+        query, params = user_manager.build_query(attributes)
+        print(f" условий: {count_conditions}")
+        measure("legacy ids", lambda: db.cursor.execute(legacy_query, legacy_params).fetchall(), repeat=1)
+        measure("ids", lambda: db.cursor.execute(query, params).fetchall(), repeat=1)
+        measure("select_on_filter", lambda: user_manager.select_on_filter(attributes), repeat=1)
+
+    db.close()
+    os.remove(path)
+
+
+def legacy_create_attribute(db: Database, attribute_key: str, attribute_value=None):
+    """Прежнее заполнение нового атрибута: отдельный executemany на каждого пользователя."""
+    db.cursor.execute("SELECT MAX(id) FROM Users;")
+    user_ids = db.cursor.fetchone()[0]
+    for user_id in range(1, user_ids + 1):
+        db.cursor.executemany("INSERT INTO UserAttributes (user_id, attribute_key, attribute_value, attribute_num) VALUES (?, ?, ?, ?);",
+                              [(user_id, attribute_key, attribute_value, numeric_value(attribute_value))])
+    db.cursor.execute("INSERT INTO Attributes (attribute_name) VALUES (?);", (attribute_key,))
+    db.commit()
+
+
+def bench_create_attribute(count_users: int):
+    """Добавление колонки: построчное заполнение против INSERT ... SELECT."""
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = Database(path)
+    fill_database(db, count_users)
+    attribute_manager = AttributeManager(db)
+
+    print(f"Добавление атрибута ({count_users} пользователей):")
+    measure("legacy create_attribute", lambda: legacy_create_attribute(db, "Разряд"), repeat=1)
+    measure("create_attribute", lambda: attribute_manager.create_attribute("Клуб"), repeat=1)
+
+    db.close()
+    os.remove(path)
+
+
+def write_roster(path: str, count_users: int):
+    """Записывает .xlsx со списком спортсменов потоково (write_only)."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(ATTRIBUTES + ["Дата рождения"])
+    for user_id in range(1, count_users + 1):
+        sheet.append([f"Спортсмен {user_id}", random.randint(50, 95), random.randint(150, 190),
+                      datetime(1990 + user_id % 20, 1 + user_id % 12, 1 + user_id % 28)])
+    workbook.save(path)
+
+
+def bench_excel_import(count_users: int):
+    """Импорт .xlsx: потоковое чтение openpyxl и вставка одной транзакцией."""
+    directory = tempfile.mkdtemp()
+    roster_path = os.path.join(directory, "roster.xlsx")
+    write_roster(roster_path, count_users)
+    path = os.path.join(directory, "bench.db")
+    db = Database(path)
+    TableManager(db).create_tables()
+
+    print(f"Импорт Excel ({count_users} строк):")
+    measure("ExcelImporter.import_file", lambda: ExcelImporter(db).import_file(roster_path), repeat=1)
+
+    db.close()
+    os.remove(path)
+    os.remove(roster_path)
+
+
+if __name__ == "__main__":
+    count_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    bench = sys.argv[2] if len(sys.argv) > 2 else "all"
+    if bench in ("indexes", "all"):
+        bench_indexes(count_users)
+    if bench in ("filters", "all"):
+        bench_filters(count_users)
+    if bench in ("attributes", "all"):
+        bench_create_attribute(count_users)
+    if bench in ("excel", "all"):
+        bench_excel_import(count_users)
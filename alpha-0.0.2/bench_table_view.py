@@ -0,0 +1,93 @@
+"""
+Замеры отрисовки UserTableModel в QTableView без экрана (QT_QPA_PLATFORM=offscreen).
+
+Запуск: python bench_table_view.py [количество_строк] [количество_атрибутов]
+"""
+import os
+import sys
+import random
+import importlib.util
+from time import perf_counter
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QApplication, QTableView, QAbstractItemView
+
+
+def load_union():
+    """Модуль интерфейса из "test_union copy.py": из-за пробела в имени его нельзя импортировать обычным import."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_union copy.py")
+    spec = importlib.util.spec_from_file_location("test_union_copy", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+union = load_union()
+
+
+class LegacyUserTableModel(union.UserTableModel):
+    """Прежние data() и flags(): список ролей, обращения к Qt.<имя> и str() на каждую ячейку."""
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid():
+            if role in [Qt.DisplayRole, Qt.EditRole]:
+                if row := self.row_data(index.row()):
+                    value = row.get(self._headers[index.column()], "")
+                    return str(value)
+
+            elif role == Qt.TextAlignmentRole:
+                return Qt.AlignCenter
+
+    def flags(self, index):
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+
+def make_rows(count_rows: int, headers: list) -> dict:
+    rows = {}
+    for row_id in range(count_rows):
+        row = {'user_id': row_id + 1}
+        for column, header in enumerate(headers):
+            row[header] = random.choice(union.names) if column % 5 == 0 else str(random.randint(40, 200))
+        rows[row_id] = row
+    return rows
+
+
+def make_model(model_class, rows: dict, headers: list):
+    db = union.Database(':memory:')
+    model = model_class(list(headers), union.UserManager(db), union.AttributeManager(db))
+    model.load_rows(rows)
+    return model
+
+
+def bench_scroll(name: str, model, count_rows: int):
+    """Прокручивает всю таблицу постранично и перерисовывает каждую страницу."""
+    view = QTableView()
+    view.resize(1600, 900)
+    view.setModel(model)
+    view.show()
+    QApplication.processEvents()
+
+    page = max(1, view.viewport().height() // view.rowHeight(0))
+    frames = 0
+    start = perf_counter()
+    for row in range(0, count_rows, page):
+        view.scrollTo(model.index(row, 0), QAbstractItemView.PositionAtTop)
+        view.viewport().repaint()
+        frames += 1
+    elapsed = perf_counter() - start
+    print(f"  {name:<12} {frames} кадров, {elapsed * 1000 / frames:6.2f} ms/кадр, всего {elapsed:6.2f} s")
+    view.close()
+
+
+if __name__ == "__main__":
+    count_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    count_attributes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    app = QApplication(sys.argv)
+
+    headers = [f"Атрибут {index}" for index in range(count_attributes)]
+    rows = make_rows(count_rows, headers)
+    print(f"Прокрутка {count_rows} строк x {count_attributes} колонок:")
+    bench_scroll("legacy", make_model(LegacyUserTableModel, rows, headers), count_rows)
+    bench_scroll("data()", make_model(union.UserTableModel, rows, headers), count_rows)
+    bench_scroll("filter", union.FilterProxyModel(make_model(union.UserTableModel, rows, headers)), count_rows)
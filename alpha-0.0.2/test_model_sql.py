@@ -1,18 +1,367 @@
 import sqlite3
+import json
 import random
-from datetime import datetime, timedelta
+import math
+import os
+import queue
+import threading
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from itertools import islice
+from datetime import datetime, date, timedelta
+
+# Ключи строки, которые не являются атрибутами UserAttributes
+SERVICE_KEYS = ('date_of_birth', 'user_id')
+
+def chunked(iterable, size: int):
+    """Разбивает итерируемый объект на списки длиной не более size."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def numeric_value(value):
+    """Возвращает числовое представление значения атрибута или None, если это не число."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value if math.isfinite(value) else None
+    try:
+        number = float(str(value).strip().replace(',', '.'))
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+# Наборы PRAGMA, которые применяются при открытии соединения
+DATABASE_PROFILES = {
+    "default": {},
+    "performance": {
+        "journal_mode": "WAL",       # Читатели не блокируют запись и наоборот
+        "synchronous": "NORMAL",     # В режиме WAL достаточно для целостности базы
+        "mmap_size": 268435456,      # 256 МБ
+        "cache_size": -65536,        # 64 МБ (отрицательное значение задается в КиБ)
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+}
+
+# Именованные параметризованные запросы; текст не меняется между вызовами,
+# поэтому SQLite берет подготовленное выражение из кэша соединения
+STATEMENTS = {
+    "users.insert": "INSERT INTO Users DEFAULT VALUES;",
+    "users.insert_id": "INSERT INTO Users (id) VALUES (?);",
+    "users.delete": "DELETE FROM Users WHERE id = ?;",
+    "users.ids": "SELECT id FROM Users;",
+    "users.max_id": "SELECT MAX(id) FROM Users;",
+    "users.ids_range": "SELECT id FROM Users WHERE id > ? AND id <= ? ORDER BY id;",
+    "users.next_id": """
+        SELECT MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'Users'), 0),
+            COALESCE((SELECT MAX(id) FROM Users), 0)
+        ) + 1;""",
+    "users.page": """
+        SELECT 
+            u.id AS user_id,
+            ua.attribute_key,
+            ua.attribute_value
+        FROM 
+            (SELECT id FROM Users WHERE id > ? ORDER BY id LIMIT ?) u
+        LEFT JOIN 
+            UserAttributes ua ON u.id = ua.user_id
+        ORDER BY 
+            u.id;""",
+    "users.select": """
+        SELECT 
+            u.id AS user_id,
+            udb.date_of_birth,
+            GROUP_CONCAT(ua.attribute_key || ': ' || ua.attribute_value, ', ') AS attributes
+        FROM 
+            Users u
+        LEFT JOIN 
+            UserAttributes ua ON u.id = ua.user_id
+        LEFT JOIN 
+            UserDateBirth udb ON u.id = udb.user_id
+        WHERE u.id = ?
+        GROUP BY 
+            u.id, udb.date_of_birth;""",
+    "user_attributes.insert": "INSERT INTO UserAttributes (user_id, attribute_key, attribute_value, attribute_num) VALUES (?, ?, ?, ?);",
+    "user_attributes.update": """
+        UPDATE UserAttributes SET attribute_value = ?, attribute_num = ?
+        WHERE user_id = ? AND attribute_key = ?;""",
+    # Только для существующих пользователей: как и UPDATE, правка удаленного пользователя ничего не пишет
+    "user_attributes.upsert": """
+        INSERT INTO UserAttributes (user_id, attribute_key, attribute_value, attribute_num)
+        SELECT ?1, ?2, ?3, ?4 WHERE EXISTS (SELECT 1 FROM Users WHERE id = ?1)
+        ON CONFLICT (user_id, attribute_key) DO UPDATE
+        SET attribute_value = excluded.attribute_value, attribute_num = excluded.attribute_num;""",
+    "user_attributes.delete_user": "DELETE FROM UserAttributes WHERE user_id = ?;",
+    "user_attributes.delete_key": "DELETE FROM UserAttributes WHERE attribute_key = ?;",
+    "user_attributes.rename": "UPDATE UserAttributes SET attribute_key = ? WHERE attribute_key = ?;",
+    "user_attributes.backfill": """
+        INSERT OR IGNORE INTO UserAttributes (user_id, attribute_key, attribute_value, attribute_num)
+        SELECT id, ?, ?, ? FROM Users;""",
+    "user_date_birth.insert": "INSERT INTO UserDateBirth (user_id, date_of_birth) VALUES (?, ?);",
+    "user_date_birth.update": "UPDATE UserDateBirth SET date_of_birth = ? WHERE user_id = ?;",
+    "user_date_birth.delete_user": "DELETE FROM UserDateBirth WHERE user_id = ?;",
+    "user_date_birth.all": "SELECT user_id, date_of_birth FROM UserDateBirth;",
+    "attributes.insert": "INSERT INTO Attributes (attribute_name) VALUES (?);",
+    "attributes.exists": "SELECT 1 FROM Attributes WHERE attribute_name = ? LIMIT 1;",
+    "attributes.delete": "DELETE FROM Attributes WHERE attribute_name = ?;",
+    "attributes.rename": "UPDATE Attributes SET attribute_name = ? WHERE attribute_name = ?;",
+    "attributes.names": """
+        SELECT attribute_name AS unique_attribute_key_count
+        FROM Attributes
+        ORDER BY id ASC;""",
+    "attributes.count": """
+        SELECT COUNT(DISTINCT attribute_name) AS unique_attribute_key_count
+        FROM Attributes;""",
+    "selected_ids.create": "CREATE TEMP TABLE IF NOT EXISTS selected_ids (user_id INTEGER PRIMARY KEY);",
+    "selected_ids.clear": "DELETE FROM temp.selected_ids;",
+    "selected_ids.insert": "INSERT OR IGNORE INTO temp.selected_ids (user_id) SELECT value FROM json_each(?);",
+    "selected_ids.users": """
+        SELECT 
+            s.user_id,
+            ua.attribute_key,
+            ua.attribute_value
+        FROM 
+            temp.selected_ids s
+        JOIN 
+            Users u ON u.id = s.user_id
+        LEFT JOIN 
+            UserAttributes ua ON ua.user_id = s.user_id
+        ORDER BY 
+            s.user_id;""",
+    "users_wide.exists": "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'UsersWide';",
+    "users_wide.page": "SELECT * FROM UsersWide WHERE user_id > ? ORDER BY user_id LIMIT ?;",
+    "pragma.data_version": "PRAGMA data_version;",
+}
+
+class FilterCache:
+    """
+    Кэш результатов select_on_filter: нормализованная сигнатура условий -> frozenset id пользователей.
+    Записи вытесняются по LRU, когда их суммарный размер превышает max_bytes.
+    Записи через UserManager и AttributeManager сбрасывают только результаты с затронутыми атрибутами
+    (удаление пользователей - только результаты, в которые они входят). Изменения из других
+    соединений видны по PRAGMA data_version и сбрасывают кэш целиком.
+    """
+    # Ключ условия по дате рождения в UserManager.build_query
+    DATE_KEY = "date"
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # signature -> (frozenset id, размер в байтах); самые старые в начале
+        self._bytes = 0
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def signature(cls, attributes: dict) -> tuple:
+        """Условия {attribute: {"min": ..., "max": ...}} в виде, не зависящем от порядка и записи чисел."""
+        return tuple(sorted(
+            (attribute, tuple(cls.normalize_bound(attribute, limits.get(limit)) for limit in ("min", "max")))
+            for attribute, limits in attributes.items()
+        ))
+
+    @classmethod
+    def normalize_bound(cls, attribute, value):
+        if value is None or attribute == cls.DATE_KEY:
+            return value
+        number = numeric_value(value)
+        return str(value) if number is None else float(number)
+
+    @classmethod
+    def attribute_keys(cls, keys) -> set:
+        """Ключи условий, на которые влияет запись в колонки keys (date_of_birth -> date)."""
+        return {cls.DATE_KEY if key == 'date_of_birth' else key for key in keys if key != 'user_id'}
+
+    def check_version(self, data_version: int):
+        """Очищает кэш, если базу изменило другое соединение."""
+        if data_version != self._data_version:
+            if self._entries:
+                self.clear()
+            self._data_version = data_version
+
+    def get(self, signature: tuple) -> frozenset | None:
+        entry = self._entries.get(signature)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(signature)
+        return entry[0]
+
+    def put(self, signature: tuple, user_ids) -> frozenset:
+        user_ids = frozenset(user_ids)
+        # Множество и сами объекты int
+        size = sys.getsizeof(user_ids) + 32 * len(user_ids)
+        if size > self.max_bytes:
+            return user_ids
+        self._drop(signature)
+        self._entries[signature] = (user_ids, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return user_ids
+
+    def invalidate(self, keys):
+        """Сбрасывает результаты, в условиях которых есть одна из колонок keys."""
+        keys = self.attribute_keys(keys)
+        for signature in [signature for signature in self._entries
+                          if any(attribute in keys for attribute, _ in signature)]:
+            self._drop(signature)
+            self.invalidations += 1
+
+    def invalidate_users(self, user_ids):
+        """Сбрасывает результаты, в которые входит один из пользователей user_ids."""
+        user_ids = frozenset(user_ids)
+        for signature in [signature for signature, (members, _) in self._entries.items()
+                          if not members.isdisjoint(user_ids)]:
+            self._drop(signature)
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations, "entries": len(self._entries), "bytes": self._bytes}
+
+    def _drop(self, signature):
+        entry = self._entries.pop(signature, None)
+        if entry is not None:
+            self._bytes -= entry[1]
 
 class Database:
-    def __init__(self, db_name='your_database.db'):
-        self.connection = sqlite3.connect(db_name)
+    def __init__(self, db_name='your_database.db', profile: str | dict = "performance",
+                 cached_statements: int = 512, check_same_thread: bool = True, readonly: bool = False,
+                 filter_cache_bytes: int = 32 * 1024 * 1024):
+        """
+        profile: имя набора из DATABASE_PROFILES или словарь {pragma: value}
+        cached_statements: размер кэша подготовленных выражений соединения
+        check_same_thread: False, если соединение передается между потоками под внешней блокировкой
+        readonly: открыть файл базы только для чтения
+        filter_cache_bytes: ограничение памяти кэша результатов select_on_filter
+        """
+        self.name = db_name
+        self.readonly = readonly
+        database = f"file:{pathname2url(os.path.abspath(db_name))}?mode=ro" if readonly else db_name
+        self.connection = sqlite3.connect(database, cached_statements=cached_statements,
+                                          check_same_thread=check_same_thread, uri=readonly)
         self.cursor = self.connection.cursor()
+        self.statements = dict(STATEMENTS)
+        self.filter_cache = FilterCache(filter_cache_bytes)
+        self.apply_profile(profile)
+
+    def statement(self, name, builder=None) -> str:
+        """
+        Возвращает текст именованного запроса.
+        Если запроса нет и передан builder, текст строится один раз и регистрируется.
+        """
+        if name not in self.statements and builder is not None:
+            self.statements[name] = builder()
+        return self.statements[name]
+
+    def register(self, name, query: str):
+        self.statements[name] = query
+
+    def execute(self, name, params=()) -> sqlite3.Cursor:
+        """Выполняет именованный запрос в отдельном курсоре, не затрагивая другие операции."""
+        cursor = self.connection.cursor()
+        cursor.execute(self.statements[name], params)
+        return cursor
+
+    def executemany(self, name, seq_of_params) -> sqlite3.Cursor:
+        cursor = self.connection.cursor()
+        cursor.executemany(self.statements[name], seq_of_params)
+        return cursor
+
+    def apply_profile(self, profile: str | dict):
+        pragmas = DATABASE_PROFILES[profile] if isinstance(profile, str) else profile
+        for name, value in (pragmas or {}).items():
+            self.cursor.execute(f"PRAGMA {name} = {value};")
+
+    def data_version(self) -> int:
+        """Меняется, когда базу изменяет другое соединение (собственные записи его не меняют)."""
+        return self.execute("pragma.data_version").fetchone()[0]
 
     def commit(self):
         self.connection.commit()
 
     def close(self):
+        try:
+            # Обновляет статистику планировщика для часто используемых запросов
+            if not self.readonly:
+                self.cursor.execute("PRAGMA optimize;")
+        except sqlite3.Error as e:
+            print(f"Ошибка при оптимизации базы данных: {e}")
         self.connection.close()
 
+class DatabasePool:
+    """
+    Пул соединений с файлом базы для многопоточных вызывающих:
+    readers соединений только для чтения (в режиме WAL читают параллельно)
+    и одно соединение для записи, которое в каждый момент занято одним потоком.
+
+    with pool.reader() as db: ...  # любое свободное соединение для чтения
+    with pool.writer() as db: ...  # commit при успехе, rollback при исключении
+    """
+    def __init__(self, db_name='your_database.db', readers: int = 4, profile: str | dict = "performance"):
+        self.db_name = db_name
+        # Соединение для записи открывается первым: оно создает файл и включает WAL
+        self._writer = Database(db_name, profile, check_same_thread=False)
+        self._writer_lock = threading.Lock()
+        self._readers = queue.Queue()
+        self._all_readers = []
+        for _ in range(readers):
+            db = Database(db_name, profile, check_same_thread=False, readonly=True)
+            self._all_readers.append(db)
+            self._readers.put(db)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        return len(self._all_readers)
+
+    @contextmanager
+    def reader(self):
+        db = self._readers.get()
+        try:
+            yield db
+        finally:
+            # Закрываем транзакцию, чтобы соединение не держало старый снимок WAL
+            if db.connection.in_transaction:
+                db.connection.rollback()
+            self._readers.put(db)
+
+    @contextmanager
+    def writer(self):
+        with self._writer_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.connection.rollback()
+                raise
+            self._writer.commit()
+
+    def close(self):
+        with self._writer_lock:
+            for db in self._all_readers:
+                db.close()
+            self._all_readers.clear()
+            self._writer.close()
+
 class User:
     def __init__(self, attributes):
         self.attributes = attributes
@@ -35,8 +384,7 @@ class User:
     def insert_user(self, db: Database) -> int:
         """Вставляет нового пользователя и возвращает его ID или None в случае ошибки."""
         try:
-            db.cursor.execute("INSERT INTO Users DEFAULT VALUES;")
-            return db.cursor.lastrowid  # Получаем id нового пользователя
+            return db.execute("users.insert").lastrowid  # Получаем id нового пользователя
         except Exception as e:
             print(f"Ошибка при вставке пользователя: {e}")
             return None
@@ -47,10 +395,8 @@ class User:
             for key, value in self.attributes.items():
                 for attribute_key, attribute_value in value.items():
                     if attribute_key != 'date_of_birth':
-                        db.cursor.execute(
-                            "INSERT INTO UserAttributes (user_id, attribute_key, attribute_value) VALUES (?, ?, ?);",
-                            (user_id, attribute_key, attribute_value)
-                        )
+                        db.execute("user_attributes.insert",
+                                   (user_id, attribute_key, attribute_value, numeric_value(attribute_value)))
                 if key == 'not_user':
                     user_id += 1  # Увеличиваем user_id, если это не пользователь
             return True  # Атрибуты успешно добавлены
@@ -64,10 +410,7 @@ class User:
             for key, value in self.attributes.items():
                 date_of_birth = value.get('date_of_birth')
                 if date_of_birth:
-                    db.cursor.execute(
-                        "INSERT INTO UserDateBirth (user_id, date_of_birth) VALUES (?, ?);",
-                        (user_id, date_of_birth)
-                    )
+                    db.execute("user_date_birth.insert", (user_id, date_of_birth))
             return True  # Дата рождения успешно добавлена
         except Exception as e:
             print(f"Ошибка при вставке даты рождения: {e}")
@@ -81,163 +424,235 @@ class UserManager:
         """
         return_type: str 'dict' or 'list'
         """
-        query = """
-        SELECT 
-            u.id AS user_id,
-            ua.attribute_key,
-            ua.attribute_value
-        FROM 
-            Users u
-        LEFT JOIN 
-            UserAttributes ua ON u.id = ua.user_id   
-        """
-        self.db.cursor.execute(query)
-        users_attributes = self.db.cursor.fetchall()
+        # {row_id: {header_name: value, header_name: value}, row_id: {header_name: value}}
+        return dict(enumerate(self.iter_users()))
 
-        query = """
-        SELECT 
-            u.id AS user_id,
-            ud.date_of_birth
-        FROM 
-            Users u
-        LEFT JOIN 
-            UserDateBirth ud ON u.id = ud.user_id
-        GROUP BY 
-            u.id;    
-        """
+    def iter_users(self, page_size: int = 1000):
+        """Генератор пользователей по возрастанию id; в памяти держится не больше одной страницы."""
+        after_id = 0
+        while page := self.select_page(after_id, page_size):
+            yield from page
+            after_id = page[-1]['user_id']
 
-        users = {}
+    def select_page(self, after_id: int = 0, limit: int = 1000) -> list[dict]:
+        """
+        Страница из limit пользователей с id > after_id (keyset-пагинация).
+        Возвращает список строк {header_name: value, 'user_id': user_id}.
+        """
+        wide_table = WideTableManager(self.db)
+        if wide_table.is_enabled():
+            return wide_table.select_page(after_id, limit)
 
-        for user_id, attribute_key, attribute_value in users_attributes:
-            if user_id - 1 not in users:
-                users[user_id - 1] = {}
-            users[user_id - 1][attribute_key] = attribute_value
-            users[user_id - 1]['user_id'] = user_id
-        # {row_id: {header_name: value, header_name: value}, row_id: {header_name: value}}
-        return users
+        users_attributes = self.db.execute("users.page", (after_id, limit)).fetchall()
+        return list(self.aggregate_user_attributes(users_attributes).values())
 
     def select_user(self, user_id):
-        query = """
-        SELECT 
-            u.id AS user_id,
-            udb.date_of_birth,
-            GROUP_CONCAT(ua.attribute_key || ': ' || ua.attribute_value, ', ') AS attributes
-        FROM 
-            Users u
-        LEFT JOIN 
-            UserAttributes ua ON u.id = ua.user_id
-        LEFT JOIN 
-            UserDateBirth udb ON u.id = udb.user_id
-        WHERE u.id = ?
-        GROUP BY 
-            u.id, udb.date_of_birth;
-        """
-        self.db.cursor.execute(query, (user_id,))
-        user = self.db.cursor.fetchall()
+        user = self.db.execute("users.select", (user_id,)).fetchall()
         return user
 
     def create_user(self, attributes: dict) -> bool:
+        self.db.filter_cache.invalidate(key for value in attributes.values() for key in value)
         user = User(attributes)
         st = user.insert(self.db)
         self.db.commit()
         return st
+
+    def bulk_create_users(self, rows, chunk_size: int = 1000, progress=None, attributes=()) -> list[int]:
+        """
+        Вставляет пользователей пачками по chunk_size через executemany в одной транзакции.
+        rows: итерируемый набор словарей {attribute_key: value, 'date_of_birth': date}
+        progress: необязательная функция, получает количество уже вставленных пользователей
+        attributes: заголовки; отсутствующие в базе атрибуты создаются в той же транзакции
+        Возвращает id созданных пользователей в порядке rows или None в случае ошибки.
+        """
+        try:
+            if not self.db.connection.in_transaction:
+                self.db.connection.execute("BEGIN IMMEDIATE;")
+            self.insert_attributes(attributes)
+            user_ids = self.insert_users(rows, chunk_size, progress)
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.db.connection.rollback()
+            print(f"Ошибка при массовой вставке пользователей: {e}")
+            return None
+        except BaseException:
+            # rows может быть генератором (импорт Excel): ошибка разбора не должна оставить транзакцию открытой
+            self.db.connection.rollback()
+            raise
+        return user_ids
+
+    def save_changes(self, created=(), updated: dict = None, deleted=(), chunk_size: int = 1000, progress=None,
+                     attributes=()) -> list[int]:
+        """
+        Сохраняет набор изменений таблицы одной транзакцией.
+        attributes: заголовки таблицы; отсутствующие в базе атрибуты создаются в той же транзакции
+        created: новые строки {attribute_key: value} для bulk-вставки
+        updated: измененные ячейки существующих пользователей {user_id: {attribute_key: value}},
+                 записываются через UPSERT только эти ячейки
+        deleted: id удаляемых пользователей
+        progress: необязательная функция, получает количество обработанных строк
+        Возвращает id созданных пользователей в порядке created или None в случае ошибки.
+        """
+        updated = updated or {}
+        deleted = list(deleted)
+        self.db.filter_cache.invalidate_users(deleted)
+        self.db.filter_cache.invalidate({key for cells in updated.values() for key in cells})
+        try:
+            if not self.db.connection.in_transaction:
+                self.db.connection.execute("BEGIN IMMEDIATE;")
+
+            self.insert_attributes(attributes)
+
+            for chunk in chunked(deleted, chunk_size):
+                params = [(user_id,) for user_id in chunk]
+                self.db.executemany("user_attributes.delete_user", params)
+                self.db.executemany("user_date_birth.delete_user", params)
+                self.db.executemany("users.delete", params)
+
+            self.db.executemany("user_attributes.upsert", (
+                (user_id, attribute_key, attribute_value, numeric_value(attribute_value))
+                for user_id, cells in updated.items()
+                for attribute_key, attribute_value in cells.items()
+                if attribute_key not in SERVICE_KEYS
+            ))
+            dates = [(user_id, cells['date_of_birth']) for user_id, cells in updated.items() if 'date_of_birth' in cells]
+            self.db.executemany("user_date_birth.delete_user", ((user_id,) for user_id, _ in dates))
+            self.db.executemany("user_date_birth.insert", ((user_id, date) for user_id, date in dates if date))
+
+            done = len(deleted) + len(updated)
+            if progress and done:
+                progress(done)
+            user_ids = self.insert_users(created, chunk_size, (lambda count: progress(done + count)) if progress else None)
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.db.connection.rollback()
+            print(f"Ошибка при сохранении изменений: {e}")
+            return None
+        except BaseException:
+            self.db.connection.rollback()
+            raise
+        return user_ids
+
+    def insert_attributes(self, attributes):
+        """
+        Создает отсутствующие атрибуты без commit и один раз перестраивает широкую таблицу;
+        транзакцией управляет вызывающий (bulk_create_users, save_changes).
+        """
+        attribute_manager = AttributeManager(self.db)
+        created = [attribute_key for attribute_key in attributes
+                   if attribute_key and attribute_key not in SERVICE_KEYS and attribute_manager.insert_attribute(attribute_key)]
+        if created:
+            WideTableManager(self.db).refresh()
+
+    def insert_users(self, rows, chunk_size: int = 1000, progress=None) -> list[int]:
+        """Вставка пользователей для bulk_create_users и save_changes; транзакцией управляет вызывающий."""
+        user_ids = []
+        next_id = self.next_user_id()
+
+        for chunk in chunked(rows, chunk_size):
+            ids = range(next_id, next_id + len(chunk))
+            next_id += len(chunk)
+            # Новые пользователи могут попасть в результаты фильтров по своим атрибутам
+            self.db.filter_cache.invalidate({key for row in chunk for key in row})
+
+            self.db.executemany("users.insert_id", ((user_id,) for user_id in ids))
+            self.db.executemany(
+                "user_attributes.insert",
+                ((user_id, attribute_key, attribute_value, numeric_value(attribute_value))
+                 for user_id, row in zip(ids, chunk)
+                 for attribute_key, attribute_value in row.items()
+                 if attribute_key not in SERVICE_KEYS)
+            )
+            self.db.executemany(
+                "user_date_birth.insert",
+                ((user_id, row['date_of_birth']) for user_id, row in zip(ids, chunk) if row.get('date_of_birth'))
+            )
+
+            user_ids.extend(ids)
+            if progress:
+                progress(len(user_ids))
+        return user_ids
+
+    def max_user_id(self) -> int:
+        """Наибольший id в Users (0 для пустой базы)."""
+        return self.db.execute("users.max_id").fetchone()[0] or 0
+
+    def select_user_ids(self, after_id: int, max_id: int) -> list[int]:
+        """Id пользователей в диапазоне (after_id, max_id] по возрастанию, без атрибутов."""
+        return [user_id for user_id, in self.db.execute("users.ids_range", (after_id, max_id))]
+
+    def next_user_id(self) -> int:
+        """Следующий id для Users с учетом sqlite_sequence (AUTOINCREMENT не переиспользует id)."""
+        return self.db.execute("users.next_id").fetchone()[0]
     
     def delete_user(self, user_id):
-        self.db.cursor.execute("DELETE FROM UserAttributes WHERE user_id = ?;", (user_id,))
-        self.db.cursor.execute("DELETE FROM UserDateBirth WHERE user_id = ?;", (user_id,))
-        self.db.cursor.execute("DELETE FROM Users WHERE id = ?;", (user_id,))
+        self.db.filter_cache.invalidate_users((user_id,))
+        self.db.execute("user_attributes.delete_user", (user_id,))
+        self.db.execute("user_date_birth.delete_user", (user_id,))
+        self.db.execute("users.delete", (user_id,))
         self.db.commit()
 
     def insert_random_birth_dates(self, start_date: str, end_date: str):
-        query = "SELECT MAX(id) FROM Users;"
-        self.db.cursor.execute(query)
-        user_ids = self.db.cursor.fetchone()[0]
+        # После удалений в id есть пропуски, а с foreign_keys=ON вставка для отсутствующего id - ошибка
+        user_ids = [user_id for user_id, in self.db.execute("users.ids").fetchall()]
+        self.db.filter_cache.invalidate(('date_of_birth',))
 
-        for user_id in range(1, user_ids + 1):
+        for user_id in user_ids:
             random_date = self.generate_random_date(start_date, end_date)
-            self.db.cursor.execute("INSERT INTO UserDateBirth (user_id, date_of_birth) VALUES (?, ?);", 
-                                   (user_id, random_date))
+            self.db.execute("user_date_birth.insert", (user_id, random_date))
         self.db.commit()
 
     def update_user_attribute(self, user_id, new_value, attribute_key):
-        self.db.cursor.execute("UPDATE UserAttributes SET attribute_value = ? WHERE user_id = ? AND attribute_key = ?", (new_value, user_id, attribute_key))
+        self.db.filter_cache.invalidate((attribute_key,))
+        self.db.execute("user_attributes.upsert", (user_id, attribute_key, new_value, numeric_value(new_value)))
         self.db.commit()  # Сохранение изменений
 
     def change_date_value(self, user_id, new_value):
-        self.db.cursor.execute("UPDATE UserDateBirth SET date_of_birth = ? WHERE user_id = ?", (new_value, user_id))
+        self.db.filter_cache.invalidate(('date_of_birth',))
+        self.db.execute("user_date_birth.update", (new_value, user_id))
         self.db.commit()   # Сохранение изменений
 
-    def select_on_filter(self, attributes: dict):
-        query, params = self.build_query(attributes)
-        self.db.cursor.execute(query, params)
-        users = self.db.cursor.fetchall()
-        if not users:
-            return
-
-        query, user_ids = self.build_query_users_attributes(users)
-        self.db.cursor.execute(query, user_ids)
-        user_attributes = self.db.cursor.fetchall()
-        if not user_attributes:
-            return
-        
-        count_atributes = AttributeManager.count_attributes(self.db)
-        if not count_atributes:
-            return
-        
-        return user_attributes, count_atributes
-    
-    def build_query(self, attributes: dict) -> tuple[str, list]:
-        """
-        Return tuple[str, list]
-        str: sql_query
-        list: params of sql_query
-        """
-        # Начало построения запроса
-        sub_query = """
-        (SELECT u.id
-        FROM Users u
-        JOIN UserAttributes ua ON u.id = ua.user_id
-        WHERE {})
-        """
+    def dates_of_birth(self) -> dict:
+        """Даты рождения всех пользователей {user_id: 'ГГГГ-ММ-ДД'}."""
+        return dict(self.db.execute("user_date_birth.all").fetchall())
 
-        date_sub_query = """
-        (SELECT u.id
-        FROM Users u 
-        JOIN UserDateBirth ud ON u.id = ud.user_id
-        WHERE {})
+    def select_on_filter(self, attributes: dict) -> dict:
         """
-
-        base_query = """
-        SELECT u.id
-        FROM Users u
-        WHERE u.id IN {}
+        Возвращает пользователей, подходящих под все условия, в формате select_all:
+        {row_id: {header_name: value, 'user_id': user_id}}
+        Id подходящих пользователей берутся из db.filter_cache, если условия уже выполнялись.
         """
+        if not attributes:
+            return {}
+        signature, user_ids = self.cached_filter_ids(attributes)
+        if user_ids is not None:
+            return self.select_users(user_ids)
 
-        condition_date = "date_of_birth BETWEEN ? AND ?"
-        condition = "(ua.attribute_key = ? AND CAST(ua.attribute_value AS INTEGER) >= ? AND CAST(ua.attribute_value AS INTEGER) <= ?)"
-
-        # Список условий для запроса
-        params = []
-        temp_query = []
+        users = self.select_filtered(attributes)
+        self.db.filter_cache.put(signature, (row['user_id'] for row in users.values()))
+        return users
 
-        for attribute, limits in attributes.items():
-            if attribute == "date":
-                temp_query.append(date_sub_query.format(condition_date))
-                params.extend([limits["min"], limits["max"]])    
-            else:
-                temp_query.append(sub_query.format(condition))
-                params.extend([attribute, limits["min"], limits["max"]])
-        
-        where_clause = "AND u.id IN".join(temp_query)
-        final_query = base_query.format(where_clause)
+    def select_ids_on_filter(self, attributes: dict) -> frozenset:
+        """Id пользователей, подходящих под все условия; повторный вызов с теми же условиями берет их из кэша."""
+        if not attributes:
+            return frozenset()
+        signature, user_ids = self.cached_filter_ids(attributes)
+        if user_ids is not None:
+            return user_ids
+        query, params = self.build_query(attributes)
+        return self.db.filter_cache.put(signature, (user_id for user_id, in self.db.connection.execute(query, params)))
 
-        return final_query, params
+    def cached_filter_ids(self, attributes: dict) -> tuple[tuple, frozenset | None]:
+        """Сигнатура условий и id из db.filter_cache (None, если результата в кэше нет)."""
+        cache = self.db.filter_cache
+        cache.check_version(self.db.data_version())
+        signature = cache.signature(attributes)
+        return signature, cache.get(signature)
 
-    def build_query_users_attributes(self, users: list[tuple[int]]) -> tuple[str, list]:
-        # Получаем список идентификаторов пользователей
-        user_ids = [user[0] for user in users]
-        placeholders = ', '.join('?' for _ in user_ids)
-        query = f"""
+    def select_filtered(self, attributes: dict) -> dict:
+        """select_on_filter без кэша: условия и строки пользователей одним запросом."""
+        query, params = self.build_query(attributes)
+        query = self.db.statement(f"users.filter:{query}", lambda: f"""
         SELECT 
             u.id AS user_id,
             ua.attribute_key,
@@ -246,18 +661,128 @@ class UserManager:
             Users u
         LEFT JOIN 
             UserAttributes ua ON u.id = ua.user_id
-        WHERE u.id IN ({placeholders})
+        WHERE u.id IN ({query})
         ORDER BY 
-            u.id;"""
-        return query, user_ids
+            u.id;""")
+        users_attributes = self.db.connection.execute(query, params).fetchall()
+        return self.aggregate_user_attributes(users_attributes)
+    
+    def build_query(self, attributes: dict) -> tuple[str, list]:
+        """
+        Компилирует условия {attribute: {"min": ..., "max": ...}} в один запрос id пользователей.
+        Условия по атрибутам проверяются за один проход с GROUP BY user_id HAVING COUNT(*) = n,
+        условие "date" по дате рождения добавляется через INTERSECT.
+        Текст запроса зависит только от формы условий и берется из реестра Database.
+        Return tuple[str, list]
+        str: sql_query
+        list: params of sql_query
+        """
+        shape = []
+        date_shape = None
+        params = []
+        date_params = []
+
+        for attribute, limits in attributes.items():
+            bounds = [limit for limit in (limits.get("min"), limits.get("max")) if limit is not None]
+            kind = (limits.get("min") is not None, limits.get("max") is not None)
+            if attribute == "date":
+                date_shape = kind
+                date_params = bounds
+            else:
+                shape.append(kind)
+                params.append(attribute)
+                params.extend(self.numeric_bound(attribute, bound) for bound in bounds)
+
+        if shape:
+            params.append(len(shape))
+        params.extend(date_params)
+
+        shape = tuple(shape)
+        query = self.db.statement(f"users.filter_ids:{shape}:{date_shape}",
+                                  lambda: self.compile_filter(shape, date_shape))
+        return query, params
+
+    @staticmethod
+    def numeric_bound(attribute, value) -> float:
+        """
+        Граница условия числом, как attribute_num и подпись FilterCache ("60,5" -> 60.5):
+        текст сравнивался бы с REAL как строка и пропускал любые значения.
+        """
+        number = numeric_value(value)
+        if number is None:
+            raise ValueError(f"{attribute}: ожидается число, получено {value!r}")
+        return number
+
+    @classmethod
+    def compile_filter(cls, shape: tuple, date_shape: tuple | None) -> str:
+        """Строит текст запроса id по форме условий: для каждого условия (есть min, есть max)."""
+        queries = []
+        if shape:
+            conditions = ' OR '.join(
+                f"(attribute_key = ? AND {cls.build_range_condition('attribute_num', kind)})" for kind in shape
+            )
+            queries.append(
+                "SELECT user_id FROM UserAttributes "
+                f"WHERE {conditions} "
+                "GROUP BY user_id HAVING COUNT(*) = ?"
+            )
+        if date_shape:
+            queries.append(f"SELECT user_id FROM UserDateBirth WHERE {cls.build_range_condition('date_of_birth', date_shape)}")
+        return " INTERSECT ".join(queries)
+
+    @staticmethod
+    def build_range_condition(column: str, kind: tuple) -> str:
+        """Условие для диапазона; отсутствующая граница (None) не ограничивает значение."""
+        has_min, has_max = kind
+        if has_min and has_max:
+            return f"{column} BETWEEN ? AND ?"
+        if has_min:
+            return f"{column} >= ?"
+        if has_max:
+            return f"{column} <= ?"
+        return f"{column} IS NOT NULL"
+
+    def select_users(self, user_ids) -> dict:
+        """
+        Возвращает пользователей по списку id в формате select_all.
+        Идентификаторы передаются через временную таблицу, а не через список '?',
+        поэтому размер списка не ограничен лимитом переменных SQLite;
+        таблица заполняется одним запросом из JSON-массива id.
+        """
+        self.db.execute("selected_ids.create")
+        self.db.execute("selected_ids.clear")
+        self.db.execute("selected_ids.insert", (json.dumps([int(user_id) for user_id in user_ids]),))
+        users_attributes = self.db.execute("selected_ids.users").fetchall()
+        self.db.execute("selected_ids.clear")
+        self.db.commit()
+        return self.aggregate_user_attributes(users_attributes)
+
+    @staticmethod
+    def aggregate_user_attributes(users_attributes) -> dict:
+        """
+        Разворачивает строки (user_id, attribute_key, attribute_value), упорядоченные по user_id,
+        в {row_id: {header_name: value, 'user_id': user_id}} с row_id по порядку.
+        """
+        users = {}
+        row = None
+        last_user_id = None
+        for user_id, attribute_key, attribute_value in users_attributes:
+            if user_id != last_user_id:
+                last_user_id = user_id
+                row = users[len(users)] = {'user_id': user_id}
+            if attribute_key is not None:
+                row[attribute_key] = attribute_value
+        return users
     
     def update_data_user(self, data: dict):
-        query = """
-        UPDATE UserAttributes SET attribute_value = ? 
-        WHERE user_id = ? AND attribute_key = ?;"""
-        for user_id, value in data.items():
-            for attribute_key, attribute_value in value.items():
-                self.db.cursor.execute(query, (attribute_value, user_id, attribute_key))
+        self.db.filter_cache.invalidate({key for value in data.values() for key in value})
+        # UPSERT: у пользователя может не быть строки атрибута (например, после импорта старым кодом)
+        self.db.executemany("user_attributes.upsert", (
+            (user_id, attribute_key, attribute_value, numeric_value(attribute_value))
+            for user_id, value in data.items()
+            for attribute_key, attribute_value in value.items()
+            if attribute_key not in SERVICE_KEYS
+        ))
         self.db.commit()                
 
     @staticmethod
@@ -274,73 +799,56 @@ class AttributeManager:
         self.db = db
     
     def create_attribute(self, attribute_key: str, attribute_value=None):
-        if self.validate_attribute(attribute_key):
-
-            # Запрос для получения последнего id
-            query = "SELECT MAX(id) FROM Users;"
-            self.db.cursor.execute(query)
-            user_ids = self.db.cursor.fetchone()[0] #+ 1
-
-            if user_ids:
-                # Вставка атрибутов для каждого пользователя
-                for user_id in range(1, user_ids):
-                    attributes = [
-                        (user_id, attribute_key, attribute_value)
-                    ]
-                    self.db.cursor.executemany("INSERT INTO UserAttributes (user_id, attribute_key, attribute_value) VALUES (?, ?, ?);", attributes)
-
-            query = "INSERT INTO Attributes (attribute_name) VALUES (?);"
-            self.db.cursor.execute(query, (attribute_key,))
+        if self.insert_attribute(attribute_key, attribute_value):
+            WideTableManager(self.db).refresh()
             # Сохранение изменений и закрытие соединения
             self.db.commit()
 
+    def insert_attribute(self, attribute_key: str, attribute_value=None) -> bool:
+        """
+        Добавляет атрибут и заполняет его у всех пользователей без commit: транзакцией управляет
+        вызывающий (create_attribute, UserManager.save_changes). False, если атрибут уже есть.
+        """
+        if not self.validate_attribute(attribute_key):
+            return False
+        self.db.filter_cache.invalidate((attribute_key,))
+
+        # Заполнение атрибута для всех пользователей одним INSERT ... SELECT
+        self.db.execute("user_attributes.backfill", (attribute_key, attribute_value, numeric_value(attribute_value)))
+        self.db.execute("attributes.insert", (attribute_key,))
+        return True
+
     def validate_attribute(self, attribute_key: str) -> bool:
         # Запрос для проверки существования атрибута с использованием EXISTS
-        query = "SELECT 1 FROM Attributes WHERE attribute_name = ? LIMIT 1;"
-        self.db.cursor.execute(query, (attribute_key,))
-        exists = self.db.cursor.fetchone() is not None
+        exists = self.db.execute("attributes.exists", (attribute_key,)).fetchone() is not None
         
         # Если запись найдена, значит атрибут существует
         return not exists
         
     def delete_attribute(self, attribute_key):
-        query = """
-        DELETE FROM UserAttributes
-        WHERE attribute_key = ?;""" 
-
-        self.db.cursor.execute(query, (attribute_key,))
-
-        query = """
-        DELETE FROM Attributes
-        WHERE attribute_name = ?;""" 
-
-        self.db.cursor.execute(query, (attribute_key,))
-        self.db.conn.commit()  # Сохранение изменений
+        self.db.filter_cache.invalidate((attribute_key,))
+        self.db.execute("user_attributes.delete_key", (attribute_key,))
+        self.db.execute("attributes.delete", (attribute_key,))
+        WideTableManager(self.db).refresh()
+        self.db.commit()  # Сохранение изменений
 
     def rename_attribute(self, attribute_key, new_attribute_key):
-        self.db.cursor.execute("UPDATE UserAttributes SET attribute_key = ? WHERE attribute_key = ?", (new_attribute_key, attribute_key))
-        self.db.cursor.execute("UPDATE UserAttributes SET attribute_name = ? WHERE attribute_name = ?", (new_attribute_key, attribute_key))
-        self.db.conn.commit()  # Сохранение изменений
+        self.db.filter_cache.invalidate((attribute_key, new_attribute_key))
+        self.db.execute("user_attributes.rename", (new_attribute_key, attribute_key))
+        self.db.execute("attributes.rename", (new_attribute_key, attribute_key))
+        WideTableManager(self.db).refresh()
+        self.db.commit()  # Сохранение изменений
     
 
     def names_all_attributes(self):
-        query = """
-        SELECT attribute_name AS unique_attribute_key_count
-        FROM Attributes
-        ORDER BY id ASC;"""
-        self.db.cursor.execute(query)
-        names_attributes = self.db.cursor.fetchall()
+        names_attributes = self.db.execute("attributes.names").fetchall()
         names_attributes = [item[0] for item in names_attributes]
         return names_attributes
 
 
     @staticmethod
     def count_attributes(db: Database):
-        query = """
-        SELECT COUNT(DISTINCT attribute_name) AS unique_attribute_key_count
-        FROM Attributes;"""
-        db.cursor.execute(query)
-        count_attributes = db.cursor.fetchall()
+        count_attributes = db.execute("attributes.count").fetchall()
         if len(count_attributes) > 0:
             count_attributes = count_attributes[0][0]
         else:
@@ -348,7 +856,229 @@ class AttributeManager:
 
         return count_attributes
     
+class ExcelImporter:
+    """
+    Потоковый импорт спортсменов из .xlsx в базу.
+    Первая строка листа - заголовки: колонки сопоставляются с Attributes (недостающие создаются
+    в транзакции вставки),
+    колонка "Дата рождения" или date_of_birth попадает в UserDateBirth.
+    Строки читаются openpyxl в режиме read_only и вставляются пачками одной транзакцией,
+    поэтому в памяти держится не больше одной пачки.
+    """
+    DATE_HEADERS = ('date_of_birth', 'Дата рождения')
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def import_file(self, file_path: str, chunk_size: int = 1000, progress=None) -> list[int]:
+        """
+        Импортирует первый лист файла.
+        progress: необязательная функция progress(done, total); total - число строк по размеру листа
+                  или 0, если размер в файле не записан
+        Возвращает id созданных пользователей или None в случае ошибки.
+        """
+        from openpyxl import load_workbook
+
+        try:
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+        except Exception as e:
+            print(f"Ошибка при открытии файла Excel: {e}")
+            return None
+        try:
+            sheet = workbook.worksheets[0]
+            rows = sheet.iter_rows(values_only=True)
+            headers = self.map_headers(next(rows, ()))
+            if not any(headers):
+                return []
+
+            # Недостающие атрибуты создаются в транзакции вставки: неудачный импорт их не оставляет
+            total = self.count_rows(sheet)
+            return UserManager(self.db).bulk_create_users(
+                self.iter_users(headers, rows), chunk_size,
+                (lambda done: progress(done, total)) if progress else None, attributes=headers
+            )
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def count_rows(sheet) -> int:
+        """Число строк данных из размера листа; sheet.max_row без размера в файле перечитал бы весь лист."""
+        from openpyxl.utils import range_boundaries
+
+        try:
+            return max(range_boundaries(sheet.calculate_dimension())[3] - 1, 0)
+        except ValueError:
+            return 0
+
+    @classmethod
+    def map_headers(cls, header_row) -> list[str | None]:
+        """Имена атрибутов по колонкам; колонки без заголовка пропускаются (None)."""
+        headers = []
+        for value in header_row:
+            header = cls.cell_text(value)
+            headers.append('date_of_birth' if header in cls.DATE_HEADERS else header)
+        return headers
+
+    @classmethod
+    def iter_users(cls, headers: list, rows):
+        """
+        Словари пользователей из строк листа; пустые строки пропускаются.
+        Пустые ячейки попадают в словарь как None, чтобы у пользователя была строка UserAttributes
+        по каждому заголовку, как после create_attribute.
+        """
+        empty = dict.fromkeys(header for header in headers if header)
+        for values in rows:
+            user = {header: text for header, value in zip(headers, values)
+                    if header and (text := cls.cell_text(value)) is not None}
+            if user:
+                yield {**empty, **user}
+
+    @staticmethod
+    def cell_text(value) -> str | None:
+        """Значение ячейки в виде текста attribute_value: целые без ".0", даты в формате ГГГГ-ММ-ДД."""
+        if value is None:
+            return None
+        if isinstance(value, (datetime, date)):
+            return value.strftime("%Y-%m-%d")
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        text = str(value).strip()
+        return text or None
+
+class WideTableManager:
+    """
+    Материализованная широкая таблица UsersWide: одна строка на пользователя
+    и одна колонка на каждую запись Attributes.
+    Таблица поддерживается триггерами на Users и UserAttributes, поэтому ее видят
+    все пути записи и все соединения, и перестраивается при изменении списка атрибутов.
+    """
+    TABLE = "UsersWide"
+    TRIGGERS = (
+        "users_wide_user_insert",
+        "users_wide_user_delete",
+        "users_wide_attribute_insert",
+        "users_wide_attribute_update",
+        "users_wide_attribute_delete",
+    )
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def is_enabled(self) -> bool:
+        return self.db.execute("users_wide.exists").fetchone() is not None
+
+    def enable(self):
+        """Создает и заполняет широкую таблицу."""
+        self.rebuild()
+        self.db.commit()
+
+    def disable(self):
+        self.drop()
+        self.db.commit()
+
+    def refresh(self):
+        """Перестраивает таблицу после изменения списка атрибутов, если она включена."""
+        if self.is_enabled():
+            self.rebuild()
+
+    def drop(self):
+        for trigger in self.TRIGGERS:
+            self.db.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+        self.db.cursor.execute(f"DROP TABLE IF EXISTS {self.TABLE};")
+
+    def columns(self) -> list[str]:
+        """Имена атрибутов, которые становятся колонками; user_id занят первичным ключом."""
+        names = AttributeManager(self.db).names_all_attributes()
+        return [name for name in dict.fromkeys(names) if name and name.lower() != 'user_id']
+
+    def rebuild(self):
+        columns = self.columns()
+        self.drop()
+
+        definitions = ''.join(f", {self.quote_identifier(column)}" for column in columns)
+        self.db.cursor.execute(f"CREATE TABLE {self.TABLE} (user_id INTEGER PRIMARY KEY{definitions});")
+
+        names = ''.join(f", {self.quote_identifier(column)}" for column in columns)
+        pivot = ''.join(", MAX(CASE WHEN ua.attribute_key = ? THEN ua.attribute_value END)" for _ in columns)
+        self.db.cursor.execute(f"""
+        INSERT INTO {self.TABLE} (user_id{names})
+        SELECT u.id{pivot}
+        FROM Users u
+        LEFT JOIN UserAttributes ua ON ua.user_id = u.id
+        GROUP BY u.id;""", columns)
+
+        self.create_triggers(columns)
+
+    def create_triggers(self, columns: list[str]):
+        self.db.cursor.execute(f"""
+        CREATE TRIGGER users_wide_user_insert AFTER INSERT ON Users
+        BEGIN
+            INSERT OR IGNORE INTO {self.TABLE} (user_id) VALUES (NEW.id);
+        END;""")
+        self.db.cursor.execute(f"""
+        CREATE TRIGGER users_wide_user_delete AFTER DELETE ON Users
+        BEGIN
+            DELETE FROM {self.TABLE} WHERE user_id = OLD.id;
+        END;""")
+        if not columns:
+            return
+
+        keys = ', '.join(self.quote_literal(column) for column in columns)
+        for trigger, event, row, value in (
+            ("users_wide_attribute_insert", "INSERT", "NEW", "NEW.attribute_value"),
+            ("users_wide_attribute_update", "UPDATE OF attribute_value", "NEW", "NEW.attribute_value"),
+            ("users_wide_attribute_delete", "DELETE", "OLD", "NULL"),
+        ):
+            assignments = ', '.join(
+                f"{self.quote_identifier(column)} = CASE WHEN {row}.attribute_key = {self.quote_literal(column)} "
+                f"THEN {value} ELSE {self.quote_identifier(column)} END"
+                for column in columns
+            )
+            self.db.cursor.execute(f"""
+            CREATE TRIGGER {trigger} AFTER {event} ON UserAttributes
+            WHEN {row}.attribute_key IN ({keys})
+            BEGIN
+                UPDATE {self.TABLE} SET {assignments} WHERE user_id = {row}.user_id;
+            END;""")
+
+    def select_page(self, after_id: int = 0, limit: int = 1000) -> list[dict]:
+        """Страница широкой таблицы в формате UserManager.select_page."""
+        cursor = self.db.execute("users_wide.page", (after_id, limit))
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, values)) for values in cursor.fetchall()]
+
+    @staticmethod
+    def quote_identifier(name: str) -> str:
+        return '"' + name.replace('"', '""') + '"'
+
+    @staticmethod
+    def quote_literal(value: str) -> str:
+        # Тела триггеров не принимают параметры, поэтому ключи встраиваются как литералы
+        return "'" + value.replace("'", "''") + "'"
+
 class TableManager:
+    # Версия схемы хранится в PRAGMA user_version
+    SCHEMA_VERSION = 3
+
+    INDEXES = {
+        "idx_user_attributes_user_key": """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_attributes_user_key
+        ON UserAttributes (user_id, attribute_key);""",
+        "idx_user_attributes_key_value": """
+        CREATE INDEX IF NOT EXISTS idx_user_attributes_key_value
+        ON UserAttributes (attribute_key, attribute_value);""",
+        # user_id в индексе делает его покрывающим для фильтров по диапазону
+        "idx_user_attributes_key_num_user": """
+        CREATE INDEX IF NOT EXISTS idx_user_attributes_key_num_user
+        ON UserAttributes (attribute_key, attribute_num, user_id);""",
+        "idx_user_date_birth_user": """
+        CREATE INDEX IF NOT EXISTS idx_user_date_birth_user
+        ON UserDateBirth (user_id);""",
+    }
+    # Индексы-ограничения схемы: на уникальном индексе держится ON CONFLICT в user_attributes.upsert,
+    # поэтому drop_indexes их не удаляет
+    CONSTRAINT_INDEXES = ("idx_user_attributes_user_key",)
+
     def __init__(self, db: Database):
         self.db = db
 
@@ -363,6 +1093,7 @@ class TableManager:
             user_id INTEGER,
             attribute_key TEXT NOT NULL,
             attribute_value TEXT,
+            attribute_num REAL,
             FOREIGN KEY (user_id) REFERENCES Users(id)
         );""")
         self.db.cursor.execute("""
@@ -377,13 +1108,71 @@ class TableManager:
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             attribute_name TEXT
         );""")        
+        self.migrate()
+        self.db.commit()
+
+    def schema_version(self) -> int:
+        self.db.cursor.execute("PRAGMA user_version;")
+        return self.db.cursor.fetchone()[0]
+
+    def migrate(self):
+        """Переводит существующую базу на текущую версию схемы."""
+        version = self.schema_version()
+        if version < 1:
+            # Уникальный индекс не создастся, пока есть дубли (user_id, attribute_key)
+            self.remove_duplicate_attributes()
+        if version < 2:
+            self.add_numeric_column()
+        if version < 3:
+            self.db.cursor.execute("DROP INDEX IF EXISTS idx_user_attributes_key_num;")
+        self.create_indexes()
+        if version < self.SCHEMA_VERSION:
+            self.db.cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION};")
+            self.db.cursor.execute("ANALYZE;")
+        self.db.commit()
+
+    def remove_duplicate_attributes(self):
+        """Оставляет для каждой пары (user_id, attribute_key) только последнюю запись."""
+        self.db.cursor.execute("""
+        DELETE FROM UserAttributes
+        WHERE id NOT IN (
+            SELECT MAX(id)
+            FROM UserAttributes
+            GROUP BY user_id, attribute_key
+        );""")
+
+    def add_numeric_column(self):
+        """Добавляет колонку attribute_num в старые базы и заполняет ее из attribute_value."""
+        self.db.cursor.execute("PRAGMA table_info(UserAttributes);")
+        columns = [column[1] for column in self.db.cursor.fetchall()]
+        if 'attribute_num' not in columns:
+            self.db.cursor.execute("ALTER TABLE UserAttributes ADD COLUMN attribute_num REAL;")
+
+        self.db.cursor.execute("SELECT id, attribute_value FROM UserAttributes;")
+        numbers = [(numeric_value(value), row_id) for row_id, value in self.db.cursor.fetchall()]
+        self.db.cursor.executemany("UPDATE UserAttributes SET attribute_num = ? WHERE id = ?;",
+                                   [item for item in numbers if item[0] is not None])
+
+    def create_indexes(self):
+        for query in self.INDEXES.values():
+            self.db.cursor.execute(query)
+
+    def drop_indexes(self):
+        """Удаляет индексы для ускорения запросов; индексы-ограничения остаются."""
+        for name in self.INDEXES:
+            if name in self.CONSTRAINT_INDEXES:
+                continue
+            self.db.cursor.execute(f"DROP INDEX IF EXISTS {name};")
         self.db.commit()
 
     def drop_tables(self):
+        self.db.filter_cache.clear()
+        WideTableManager(self.db).drop()
         self.db.cursor.execute("DROP TABLE IF EXISTS UserAttributes;")
         self.db.cursor.execute("DROP TABLE IF EXISTS Attributes;")
         self.db.cursor.execute("DROP TABLE IF EXISTS UserDateBirth;")
         self.db.cursor.execute("DROP TABLE IF EXISTS Users;")
+        self.db.cursor.execute("PRAGMA user_version = 0;")
         self.db.commit()
         print("Все таблицы успешно сброшены.")
 
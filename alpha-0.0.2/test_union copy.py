@@ -1,16 +1,38 @@
 import sys
+import io
+import csv
+import locale
 from typing import Any
-import pandas as pd
+from math import isfinite
+from collections.abc import MutableMapping
+import numpy as np
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QTableView, QVBoxLayout, QWidget,
     QPushButton, QLineEdit, QDialog, QFormLayout, QLabel, QHeaderView, QMenu,
     QFileDialog, QListWidget, QHBoxLayout, QMessageBox
 )
-from PySide6.QtCore import Qt, QAbstractTableModel
+from PySide6.QtCore import (Qt, QAbstractTableModel, QAbstractProxyModel, QModelIndex, QObject, QThread,
+                            Signal, Slot, QMetaObject)
 from PySide6.QtGui import (QAction, QStandardItem, QStandardItemModel,
                            QIcon)
 from test_model_sql import *
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from bisect import bisect_right
+from itertools import repeat
+
+# Значения перечислений Qt для горячих методов модели: в PySide6 каждое обращение Qt.<имя> заметно дороже
+DISPLAY_ROLE = Qt.DisplayRole
+EDIT_ROLE = Qt.EditRole
+ALIGNMENT_ROLE = Qt.TextAlignmentRole
+ALIGN_CENTER = Qt.AlignCenter
+HORIZONTAL = Qt.Horizontal
+DESCENDING_ORDER = Qt.DescendingOrder
+ITEM_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+NO_ITEM_FLAGS = Qt.NoItemFlags
+
+# С какого числа диапазонов удаление строк перестраивает таблицу одним layoutChanged,
+# а не парой beginRemoveRows/endRemoveRows (O(n) сдвиг строк) на каждый диапазон
+REMOVE_RANGES_LAYOUT = 32
 
 # Список из 30 имен
 names = [
@@ -35,6 +57,7 @@ class StatusManager:
     """Менеджер для управления статусами элементов."""
     def __init__(self):
         self._statuses = defaultdict(Status) 
+        self._changed_keys = set()  # Ключи со статусом changed, чтобы не обходить все статусы
 
     def get_status(self, key):
         """Получает статус для указанного ключа."""
@@ -49,6 +72,10 @@ class StatusManager:
         status.new = new_status.new
         status.changed = new_status.changed
         status.exist = new_status.exist
+        if status.changed:
+            self._changed_keys.add(key)
+        else:
+            self._changed_keys.discard(key)
 
     def update_statuses(self, keys, new_status):
         """Обновляет статусы для списка ключей."""
@@ -59,26 +86,44 @@ class StatusManager:
         """Удаляет статус для указанного ключа."""
         if key in self._statuses:
             del self._statuses[key]
+        self._changed_keys.discard(key)
+
+    def move_status(self, old_key, new_key):
+        """Переносит статус на новый ключ."""
+        if old_key in self._statuses:
+            self._statuses[new_key] = self._statuses.pop(old_key)
+        if old_key in self._changed_keys:
+            self._changed_keys.discard(old_key)
+            self._changed_keys.add(new_key)
+
+    def changed_keys(self) -> set:
+        """Ключи элементов со статусом changed."""
+        return self._changed_keys
 
 # Модель данных для QTableView
 class UserTableModel(QAbstractTableModel):
     def __init__(self, headers, user_manager: UserManager, attribute_manager: AttributeManager):
         super().__init__()
-        self._data: ObservableDict = {}
+        self._data: ObservableDict = ObservableDict()
+        # Строки хранятся под постоянными ключами; позиция строки в таблице -> ключ
+        self._order = []
+        self._next_key = 0
         self.user_manager = user_manager
         self.attribute_manager = attribute_manager
         # Данные в формате {row_id: {header_name: value}}
         self._headers = headers
         self.copied_data = None  # Для хранения скопированных данных
+        self._deleted_user_ids = set()  # Пользователи удаленных строк, которые еще не удалены из базы
+        # Отформатированные строки для data(): {ключ строки: [текст ячейки по колонкам]}
+        self._display_cache = {}
+        self.display_cache_rows = 4096
+        # Отсортированные ключи строк: {(заголовок, по убыванию): np.ndarray}; LRU, самые старые в начале
+        self._sort_cache = OrderedDict()
+        self.sort_cache_size = 8
 
     def get_data_changed(self) -> dict:
         """Возвращает измененные данные."""
-        new_data = {}
-        data_cp = self._data.copy()
-        for key, val in data_cp.items():
-            if self.is_data_changed(key):
-                new_data[key] = val
-        return new_data
+        return {key: self._data[key] for key in self._data.changed_keys()}
 
     def is_data_changed(self, key) -> bool:
         """Проверяет, изменены ли данные по заданному ключу."""
@@ -86,150 +131,368 @@ class UserTableModel(QAbstractTableModel):
         return status.changed
 
     def save_action(self) -> bool:
-        """Сохраняет измененные данные и создает атрибуты и пользователей."""
-        data = self.get_data_changed()
-        if data:
-            self.create_attributes()
-            status_user = self.create_users(data)
-            self._data.update_statuses(self._data.keys(), Status(new=False, changed=False, exist=True))
-            return status_user
-        return False
-
-    def create_attributes(self):
-        """Создает атрибуты для всех заголовков."""
-        for attribute in self._headers:
-            self.attribute_manager.create_attribute(attribute)
-
-    def create_users(self, data: dict):
-        """Создает пользователей на основе измененных данных."""
-
-        status_operations = {}
-
-        for key, val in data.items():
-            t_dic = {key: val}
-            status_operation = self.user_manager.create_user(t_dic)
-            status_operations[key] = status_operation
-
-        has_false = not all(status_operations.values())
-        return not has_false
+        """Сохраняет изменения таблицы: новые строки, измененные ячейки и удаленные строки."""
+        save_job = self.get_save_job()
+        if save_job is None:
+            return False
+        job, changes = save_job
+        return self.finish_save(changes, job(self.user_manager, self.attribute_manager))
+
+    def get_save_job(self):
+        """
+        Готовит сохранение для выполнения в любом потоке.
+        Возвращает (job, changes) или None, если сохранять нечего:
+        job(user_manager, attribute_manager, progress=None) -> list[int] | None
+        changes: снимок набора изменений
+            'created': новые строки {row_id: row}
+            'updated': измененные ячейки по строкам {row_id: {header: value}}
+            'cells': измененные ячейки {user_id: {header: value}}
+            'deleted': id пользователей удаленных строк
+        """
+        changes = self.get_changes()
+        if not (changes['created'] or changes['cells'] or changes['deleted']):
+            return None
+        headers = list(self._headers)
+
+        def job(user_manager, attribute_manager, progress=None):
+            return self.save_changes(user_manager, changes, headers, progress)
+        return job, changes
+
+    def get_changes(self) -> dict:
+        """Собирает набор изменений; стоимость зависит от числа правок, а не от размера таблицы."""
+        updated = {}
+        cells = {}
+        changed_keys = self._data.changed_keys()
+        created = self._data.rows(key for key in changed_keys if self._data.status(key).new)
+        for key in changed_keys:
+            if key in created:
+                continue
+            updated[key] = {header: self._data.cell(key, header) for header in self._data.dirty_cells(key)}
+            if (user_id := self._data.user_id(key)) is not None:
+                cells[user_id] = {header: value for header, value in updated[key].items() if header not in SERVICE_KEYS}
+        return {'created': created, 'updated': updated, 'cells': cells, 'deleted': sorted(self._deleted_user_ids)}
+
+    def finish_save(self, changes: dict, user_ids) -> bool:
+        """Применяет результат сохранения к модели; вызывается в потоке интерфейса."""
+        if user_ids is None:
+            return False
+
+        saved_status = Status(new=False, changed=False, exist=True)
+        created = changes['created']
+        for saved, user_id in zip(created.values(), user_ids):
+            saved['user_id'] = user_id
+        # Запоминаем присвоенные id, чтобы строки были связаны с пользователями в базе
+        current = self._data.rows(created)
+        # Строку удалили, пока шло сохранение: ее пользователь уже в базе и удалится следующим сохранением
+        self._deleted_user_ids.update(saved['user_id'] for key, saved in created.items() if key not in current)
+        self._data.set_user_ids(current, (created[key]['user_id'] for key in current))
+        for key, row in current.items():
+            saved = created[key]
+            row['user_id'] = saved['user_id']
+            # Строка теперь есть в базе; ячейки, отредактированные во время сохранения, остаются измененными
+            self._data.update_status(key, saved_status)
+            if row != saved:
+                self._data.mark_saved(key, {**dict.fromkeys(self._headers), **saved})
+
+        for key, saved in changes['updated'].items():
+            if key in self._data:
+                self._data.mark_saved(key, saved)
+
+        self._deleted_user_ids.difference_update(changes['deleted'])
+        return True
+
+    @staticmethod
+    def save_changes(user_manager: UserManager, changes: dict, headers: list, progress=None):
+        """
+        Записывает набор изменений одной транзакцией вместе с созданием атрибутов
+        для новых заголовков и возвращает id созданных пользователей.
+        """
+        total = len(changes['deleted']) + len(changes['cells']) + len(changes['created'])
+        return user_manager.save_changes(
+            changes['created'].values(), changes['cells'], changes['deleted'],
+            progress=(lambda done: progress(done, total)) if progress else None, attributes=headers
+        )
+
+    def load_rows(self, data: dict):
+        """Заменяет строки модели данными из базы."""
+        self.beginResetModel()
+        self._data = ObservableDict()
+        self._data.load_from_db(data)
+        self._order = list(data)
+        self._next_key = max(data, default=-1) + 1
+        self._deleted_user_ids.clear()
+        self._display_cache.clear()
+        self._sort_cache.clear()
+        self.endResetModel()
 
             
     def get_data(self):
         return self._data
     
+    def row_key(self, row):
+        """Постоянный ключ строки в ObservableDict по ее позиции или None."""
+        return self._order[row] if 0 <= row < len(self._order) else None
+
+    def row_data(self, row) -> dict | None:
+        """Возвращает данные строки или None, если строки нет."""
+        key = self.row_key(row)
+        return None if key is None else self._data.get(key)
+
     def set_data(self, row_id, value):
-        if self._data.get(row_id, False):
-            self._data[row_id] = value
+        if self.row_data(row_id) is not None:
+            # Вставляемые значения дополняют строку, остальные ячейки сохраняются
+            key = self._order[row_id]
+            self._data[key] = value
+            self._display_cache.pop(key, None)
+            self.invalidate_sort(value)
             self.dataChanged.emit(self.index(row_id, 0), self.index(row_id, len(self._headers) - 1))
         else:
             raise KeyError("Row ID does not exist.")
         
     def del_data(self, row_id):
-        if self._data.get(row_id, False):
-            del self._data[row_id]
+        self.removeRows(row_id, 1)
+
+    def mark_deleted(self, key):
+        """Запоминает пользователя удаляемой строки, чтобы удалить его из базы при сохранении."""
+        if not self._data.status(key).new and (user_id := self._data.user_id(key)) is not None:
+            self._deleted_user_ids.add(user_id)
 
     def get_headers(self):
         return self._headers
 
     # Метод для копирования данных
-    def copyData(self, rows, columns):
+    def copyData(self, rows, columns) -> str:
+        """
+        Копирует выделение (строки и колонки по порядку) в copied_data
+        и возвращает его в виде TSV для буфера обмена (формат, который понимает Excel).
+        """
+        headers = [self._headers[column] for column in sorted(set(columns))]
         self.copied_data = []
-        for row in rows:
-            row_data = [self._data[row].get(self._headers[col], "") for col in columns]
-            self.copied_data.append(row_data)
-
-    def pasteData(self, row, column):
-        if self.copied_data is None:
+        for row in sorted(set(rows)):
+            row_data = self.row_data(row)
+            self.copied_data.append(["" if row_data is None else row_data.get(header, "") for header in headers])
+        return self.to_tsv(self.copied_data)
+
+    @staticmethod
+    def to_tsv(values: list[list]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter='\t', lineterminator='\r\n').writerows(values)
+        return buffer.getvalue()
+
+    @staticmethod
+    def parse_tsv(text: str) -> list[list[str]]:
+        """Разбирает TSV из буфера обмена за один проход; кавычки Excel для ячеек с переводами строк учитываются."""
+        values = list(csv.reader(io.StringIO(text), delimiter='\t'))
+        while values and not any(values[-1]):
+            values.pop()  # Excel завершает выделение переводом строки
+        return values
+
+    def pasteText(self, row, column, text: str):
+        """Вставляет TSV из буфера обмена начиная с ячейки (row, column)."""
+        self.pasteData(row, column, self.parse_tsv(text))
+
+    def pasteData(self, row, column, values: list[list] = None, rows: list[int] = None):
+        """
+        Вставляет прямоугольник значений (по умолчанию copied_data) начиная с ячейки (row, column).
+        rows - позиции строк для вставки по порядку (например, видимые строки фильтра),
+        по умолчанию строки подряд начиная с row.
+        Недостающие строки добавляются одним beginInsertRows, об изменении ячеек
+        представление уведомляется одним dataChanged на каждый непрерывный диапазон строк.
+        """
+        values = self.copied_data if values is None else values
+        if not values:
             return
         # Проверяем, подходит ли вставляемые данные к существующей структуре
         if row < 0 or column < 0:
             return  # Неверные индексы
 
-        for i, row_data in enumerate(self.copied_data):
-            target_row = row + i
-            if target_row >= len(self._data):
-                self.addRow()  # Добавляем новую строку, если необходимо
-
-            # Проверяем, чтобы не выйти за пределы существующих заголовков
-            if column + len(row_data) > len(self._headers):
-                raise IndexError("Вставляемые данные выходят за пределы существующих заголовков.")
-
-            inputs = dict(zip(self._headers[column:column + len(row_data)], row_data))
-            self.set_data(target_row, inputs)
+        width = max(len(row_values) for row_values in values)
+        # Проверяем, чтобы не выйти за пределы существующих заголовков
+        if column + width > len(self._headers):
+            raise IndexError("Вставляемые данные выходят за пределы существующих заголовков.")
+        headers = self._headers[column:column + width]
+
+        if rows is None:
+            rows = range(row, len(self._order))
+        targets = rows[:len(values)]
+        for target, row_values in zip(targets, values):
+            self.row_data(target)  # Подгружает строку в ленивой модели
+            key = self._order[target]
+            for header, value in zip(headers, row_values):
+                self._data.set_cell(key, header, value)
+            self._display_cache.pop(key, None)
+
+        self.invalidate_sort(headers)
+        if len(targets) < len(values):
+            self.insert_rows([dict(zip(headers, row_values)) for row_values in values[len(targets):]])
 
         # Уведомляем об изменении данных
-        self.dataChanged.emit(self.index(row, 0), self.index(row + len(self.copied_data) - 1, len(self._headers) - 1))
+        for first, last in self.row_ranges(targets):
+            self.dataChanged.emit(self.index(first, column), self.index(last, column + width - 1))
+
+    def insert_rows(self, rows: list[dict]):
+        """Добавляет новые строки в конец таблицы одним beginInsertRows."""
+        if not rows:
+            return
+        first_row = len(self._order)
+        keys = range(self._next_key, self._next_key + len(rows))
+        self._next_key += len(rows)
+        empty = dict.fromkeys(self._headers, "")
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(rows) - 1)
+        self._data.add_rows(keys, [{**empty, **row} for row in rows])
+        self._order.extend(keys)
+        self._sort_cache.clear()
+        self.endInsertRows()
 
 
     def addRow(self):
-        new_row_id = len(self._data) # Используем новый ID для строки
-        self._data[new_row_id] = {header: "" for header in self._headers}  # Добавляем пустую строку
-        self.beginInsertRows(self.index(len(self._data), 0), len(self._data), len(self._data))        
+        row = len(self._order)
+        key = self._next_key  # Новый постоянный ключ строки
+        self._next_key += 1
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._data[key] = {header: "" for header in self._headers}  # Добавляем пустую строку
+        self._order.append(key)
+        self._sort_cache.clear()
         self.endInsertRows()
 
-    def removeRow(self, row):
-        if row not in self._data:
-            return  # Проверка на допустимость индекса строки
+    def removeRow(self, row, parent=QModelIndex()):
+        return self.removeRows(row, 1, parent)
 
-        self.beginRemoveRows(self.index(row, 0), row, row)
-        self.del_data(row_id=row)# Удаляем данные в строке
-        self.endRemoveRows()
+    def removeRows(self, row, count, parent=QModelIndex()):
+        """Удаляет count строк начиная с row; ключи остальных строк не меняются."""
+        if parent.isValid() or count <= 0 or row < 0 or row + count > len(self._order):
+            return False
+        self._remove_ranges([(row, row + count - 1)])
+        return True
 
-        # Обновляем row_id только для строк, которые идут после удаленной
-        self.reassign_row_ids(row)
+    def removeRowRanges(self, rows):
+        """
+        Удаляет строки по набору позиций: соседние позиции объединяются в диапазоны,
+        каждый диапазон удаляется одним beginRemoveRows/endRemoveRows снизу вверх;
+        при большом числе разрозненных диапазонов - одним layoutChanged.
+        """
+        self._remove_ranges(self.row_ranges(rows))
 
-        # Уведомляем об изменении данных
+    def _remove_ranges(self, ranges):
+        """
+        Удаляет отсортированные непересекающиеся диапазоны позиций (first, last).
+        Кэш сортировки перестраивается один раз после удаления всех диапазонов.
+        """
+        if not ranges:
+            return
+        if len(ranges) > REMOVE_RANGES_LAYOUT:
+            removed = self._remove_ranges_layout(ranges)
+        else:
+            removed = []
+            for first, last in reversed(ranges):
+                # Снизу вверх: позиции еще не удаленных диапазонов не сдвигаются
+                self.beginRemoveRows(QModelIndex(), first, last)
+                keys = self._order[first:last + 1]
+                self._drop_rows(keys)
+                del self._order[first:last + 1]
+                removed.extend(keys)
+                self.endRemoveRows()
+        # Без удаленных строк сохраненный порядок остается отсортированным
+        for sort_key, keys in self._sort_cache.items():
+            self._sort_cache[sort_key] = keys[~np.isin(keys, removed)]
+
+    def _remove_ranges_layout(self, ranges) -> np.ndarray:
+        """Удаляет диапазоны за один проход по маске; постоянные индексы удаленных строк становятся невалидными."""
+        self.layoutAboutToBeChanged.emit()
+        order = np.array(self._order, dtype=np.int64)
+        keep = np.ones(len(order), dtype=bool)
+        for first, last in ranges:
+            keep[first:last + 1] = False
+        removed = order[~keep]
+        self._drop_rows(removed.tolist())
+        self._order = order[keep].tolist()
+        persistent = self.persistentIndexList()
+        if persistent:
+            rows = np.cumsum(keep) - 1  # Новая позиция - число оставшихся строк до нее
+            self.changePersistentIndexList(persistent, [
+                self.index(int(rows[index.row()]), index.column()) if keep[index.row()] else QModelIndex()
+                for index in persistent])
         self.layoutChanged.emit()
+        return removed
 
-    def reassign_row_ids(self, ids):
-        """Переопределяет row_id для строк, которые идут после удаленной строки."""
-        new_data = self.get_data().copy()
-
-        for old_row_id in self.get_data().keys():
-            if old_row_id > ids:
-                new_data[old_row_id - 1] = self._data[old_row_id]
-                new_data.pop(old_row_id)
+    def _drop_rows(self, keys):
+        for key in keys:
+            self.mark_deleted(key)
+            del self._data[key]  # Удаляем данные строки вместе со статусом
+            self._display_cache.pop(key, None)
+
+    @staticmethod
+    def row_ranges(rows) -> list[tuple[int, int]]:
+        """Непрерывные диапазоны (first, last) из набора позиций строк."""
+        ranges = []
+        for row in sorted(set(rows)):
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1] = (ranges[-1][0], row)
             else:
-                new_data[old_row_id] = self._data[old_row_id]
-        self._data = new_data
+                ranges.append((row, row))
+        return ranges
 
 
-    def rowCount(self, parent=None):
-        return len(self._data)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._order)
 
-    def columnCount(self, parent=None):
-        return len(self._headers)
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
 
-    def headerData(self, section, orientation, role=Qt.DisplayRole):
-        if role == Qt.DisplayRole:
-            if orientation == Qt.Horizontal:
+    def headerData(self, section, orientation, role=DISPLAY_ROLE):
+        if role == DISPLAY_ROLE:
+            if orientation == HORIZONTAL:
                 return self._headers[section]
             else:
                 return section + 1  # Нумерация строк
         return None
     
-    def data(self, index, role=Qt.DisplayRole):
-        if index.isValid():
-            if role in [Qt.DisplayRole, Qt.EditRole]:
-                if row := self._data.get(index.row(), False):
-                    value = row.get(self._headers[index.column()], "")
-                    return str(value)
+    def data(self, index, role=DISPLAY_ROLE):
+        return self.cell_data(index.row(), index.column(), role)
+
+    def cell_data(self, row, column, role=DISPLAY_ROLE):
+        """data() по позиции ячейки; прокси-модели вызывают его без создания QModelIndex."""
+        # Вызывается на каждую ячейку при каждой перерисовке: без выделений памяти на горячем пути
+        if role == DISPLAY_ROLE or role == EDIT_ROLE:
+            if row < 0 or row >= len(self._order):
+                return None
+            cells = self._display_cache.get(self._order[row])
+            if cells is None:
+                cells = self.display_row(row)
+                if cells is None:
+                    return None
+            return cells[column]
+        if role == ALIGNMENT_ROLE:
+            return ALIGN_CENTER
+        return None
 
-            elif role == Qt.TextAlignmentRole:
-                return Qt.AlignCenter
+    def display_row(self, row) -> list[str] | None:
+        """Форматирует строку целиком и кладет ее в кэш data()."""
+        if self.row_data(row) is None:
+            return None
+        key = self._order[row]
+        cells = self._data.display_row(key, self._headers)
+        if len(self._display_cache) >= self.display_cache_rows:
+            self._display_cache.clear()
+        self._display_cache[key] = cells
+        return cells
 
     def setData(self, index, value, role):
-        if index.isValid() and role == Qt.EditRole:
-            temp = self._data[index.row()].copy()
-            temp[self._headers[index.column()]] = value
-            self._data[index.row()] = temp
+        if index.isValid() and role == EDIT_ROLE:
+            if self.row_data(index.row()) is None:
+                return False
+            key = self._order[index.row()]
+            header = self._headers[index.column()]
+            if self._data.set_cell(key, header, value):
+                self._display_cache.pop(key, None)
+                self.invalidate_sort((header,))
+                self.dataChanged.emit(index, index)
             return True
         return False  # Возвращаем False, если роль не соответствует
 
     
     def flags(self, index):
-        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
-        # return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+        return ITEM_FLAGS if index.isValid() else NO_ITEM_FLAGS
 
     def editData(self, row):
         ...
@@ -242,8 +505,8 @@ class UserTableModel(QAbstractTableModel):
     def addColumn(self, header):
         self.beginInsertColumns(self.index(0, len(self._headers)), len(self._headers), len(self._headers))
         self._headers.append(header)
-        for row in self._data.values():
-            row[header] = ""  # Добавляем пустое значение для новой колонки
+        self._data.add_column(header, "")  # Добавляем пустое значение для новой колонки
+        self._display_cache.clear()
         self.endInsertColumns()
 
     def removeColumn(self, column):
@@ -254,32 +517,825 @@ class UserTableModel(QAbstractTableModel):
         key = self._headers[column]
         del self._headers[column]
         
-        # Удаляем данные в каждой строке для этой колонки
-        for row in self._data.values():
-            del row[key]  # Убедитесь, что вы удаляете правильный ключ
+        # Удаляем данные этой колонки
+        self._data.remove_column(key)
+        self._display_cache.clear()
+        self.invalidate_sort((key,))
 
         self.endRemoveColumns()
-        self.layoutChanged.emit()  # Уведомляем об изменении данных
 
-    def loadDataFromExcel(self, file_path):
-        # Считываем данные из Excel, начиная с первой строки и первого столбца
-        df = pd.read_excel(file_path, header=0)  # Укажите нужный номер строки для заголовков
-        self._headers = df.columns.tolist()
-        self._data = df.values.tolist()
-        self.layoutChanged.emit()  # Обновляем представление
+    def loadDataFromExcel(self, file_path, progress=None) -> list[int] | None:
+        """Импортирует первый лист файла Excel в базу и перечитывает таблицу; возвращает id созданных пользователей."""
+        user_ids = ExcelImporter(self.user_manager.db).import_file(file_path, progress=progress)
+        if user_ids is not None:
+            self.set_headers(self.attribute_manager.names_all_attributes())
+            self.reload()
+        return user_ids
+
+    def set_headers(self, headers: list):
+        """Заменяет набор колонок (например, после импорта новых атрибутов)."""
+        self.beginResetModel()
+        self._headers[:] = headers
+        self._display_cache.clear()
+        self._sort_cache.clear()
+        self.endResetModel()
+
+    def reload(self):
+        """Перечитывает строки из базы."""
+        self.load_rows(self.user_manager.select_all())
+
+    def match_rows(self, group: "ConditionGroup", first: int = 0, count: int = None) -> np.ndarray:
+        """
+        Позиции загруженных строк, подходящих под группу условий (без запросов к базе).
+        first/count ограничивают проверку диапазоном позиций; позиции возвращаются абсолютные.
+        """
+        keys = self._order if first == 0 and count is None else self._order[first:None if count is None else first + count]
+        slots = self._data.slots(keys)
+        loaded = slots >= 0  # В ленивой модели часть строк может быть не загружена
+        mask = np.zeros(len(slots), dtype=bool)
+        mask[loaded] = group.to_predicate()(self._data.store, slots[loaded])
+        return first + np.flatnonzero(mask)
+
+    def row_keys(self, rows: np.ndarray) -> np.ndarray:
+        """Постоянные ключи строк по массиву позиций."""
+        return np.array(self._order, dtype=np.int64)[rows]
+
+    def key_rows(self, keys: np.ndarray) -> np.ndarray:
+        """Текущие позиции строк по массиву ключей (-1 для удаленных строк)."""
+        rows = np.full(self._next_key, -1, dtype=np.int64)
+        rows[np.array(self._order, dtype=np.int64)] = np.arange(len(self._order))
+        return rows[keys]
+
+    def new_rows(self, first: int, count: int) -> list[int]:
+        """Позиции строк диапазона, добавленных в таблице и еще не сохраненных в базу."""
+        return [first + offset for offset, key in enumerate(self._order[first:first + count])
+                if key in self._data and self._data.status(key).new]
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """
+        Упорядочивает строки по колонке: числа по величине, текст по правилам локали, пустые в конце.
+        Сортируется всегда исходный порядок ключей, поэтому результат зависит только от значений колонки
+        и кэшируется для пары (колонка, направление) до правки этой колонки.
+        """
+        if not (0 <= column < len(self._headers)):
+            return
+        header = self._headers[column]
+        sort_key = (header, order == DESCENDING_ORDER)
+        keys = self._sort_cache.get(sort_key)
+        if keys is None:
+            keys = np.sort(np.array(self._order, dtype=np.int64))
+            keys = keys[self._data.store.argsort(header, self._data.slots(keys), sort_key[1])]
+            self._sort_cache[sort_key] = keys
+            if len(self._sort_cache) > self.sort_cache_size:
+                self._sort_cache.popitem(last=False)
+        self._sort_cache.move_to_end(sort_key)
+
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        moved = [self._order[index.row()] for index in persistent]
+        self._order = keys.tolist()
+        if persistent:
+            rows = np.empty(self._next_key, dtype=np.int64)
+            rows[keys] = np.arange(len(keys))
+            self.changePersistentIndexList(
+                persistent, [self.index(int(rows[key]), index.column()) for key, index in zip(moved, persistent)])
+        self.layoutChanged.emit()
+
+    def invalidate_sort(self, headers):
+        """Забывает сохраненный порядок для измененных колонок."""
+        for sort_key in [sort_key for sort_key in self._sort_cache if sort_key[0] in headers]:
+            del self._sort_cache[sort_key]
+
+    def has_changes(self) -> bool:
+        """Есть ли несохраненные правки."""
+        return bool(self._data.changed_keys() or self._deleted_user_ids)
 
     def output_data(self):
         return self._data
 
+class LazyUserTableModel(UserTableModel):
+    """
+    Модель, подгружающая пользователей страницами по мере прокрутки (canFetchMore/fetchMore).
+    В памяти держится не больше max_blocks блоков строк: неизмененные блоки
+    вытесняются по LRU и перечитываются из базы при следующем обращении.
+    Блок занимает непрерывный диапазон постоянных ключей строк, поэтому удаление строк его не сдвигает.
+    """
+    def __init__(self, headers, user_manager: UserManager, attribute_manager: AttributeManager,
+                 page_size: int = 500, max_blocks: int = 40):
+        super().__init__(headers, user_manager, attribute_manager)
+        self.page_size = page_size
+        self.max_blocks = max_blocks
+        self._last_user_id = 0
+        # Страницы читаются до наибольшего id на момент открытия: пользователи, созданные
+        # сохранением строк таблицы, уже есть в модели и не должны подгрузиться второй раз
+        self._max_user_id = None
+        self._exhausted = False
+        self._key_user_ids = {}  # Ключ строки из базы -> user_id, в том числе для вытесненных блоков
+        # Блоки загруженных из базы строк: первый ключ, число строк и after_id для перечитывания
+        self._block_first_keys = []
+        self._block_sizes = []
+        self._block_after_ids = []
+        self._pinned_blocks = set()
+        self._loaded_blocks = OrderedDict()  # LRU: самые старые блоки в начале
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._order)
+
+    def reload(self):
+        """Сбрасывает загруженные блоки; представление заново подгрузит строки через fetchMore."""
+        self.beginResetModel()
+        self._data = ObservableDict()
+        self._order = []
+        self._display_cache.clear()
+        self._deleted_user_ids.clear()
+        self._last_user_id = 0
+        self._max_user_id = None
+        self._exhausted = False
+        self._key_user_ids = {}
+        self._block_first_keys = []
+        self._block_sizes = []
+        self._block_after_ids = []
+        self._pinned_blocks = set()
+        self._loaded_blocks = OrderedDict()
+        self.endResetModel()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Строки подгружаются из базы страницами по user_id, поэтому ленивая модель не сортируется."""
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+
+        if self._max_user_id is None:
+            self._max_user_id = self.user_manager.max_user_id()
+        page = self.user_manager.select_page(self._last_user_id, self.page_size)
+        if len(page) < self.page_size or page[-1]['user_id'] >= self._max_user_id:
+            self._exhausted = True
+            page = [row for row in page if row['user_id'] <= self._max_user_id]
+        if not page:
+            return
+
+        block = len(self._block_first_keys)
+        first_key = self._next_key
+        self._next_key += len(page)
+        self._block_first_keys.append(first_key)
+        self._block_sizes.append(len(page))
+        self._block_after_ids.append(self._last_user_id)
+        self._last_user_id = page[-1]['user_id']
+        self._key_user_ids.update(zip(range(first_key, first_key + len(page)), (row['user_id'] for row in page)))
+
+        first_row = len(self._order)
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(page) - 1)
+        self._order.extend(range(first_key, first_key + len(page)))
+        self._store_block(block, page)
+        self.endInsertRows()
+
+    def fetch_all(self):
+        """
+        Добавляет все оставшиеся строки одним beginInsertRows, не читая их атрибуты:
+        из базы берутся только id, блоки создаются вытесненными и подгружаются при обращении.
+        """
+        if self._exhausted:
+            return
+        if self._max_user_id is None:
+            self._max_user_id = self.user_manager.max_user_id()
+        user_ids = self.user_manager.select_user_ids(self._last_user_id, self._max_user_id)
+        self._exhausted = True
+        if not user_ids:
+            return
+
+        first_row = len(self._order)
+        first_key = self._next_key
+        self._next_key += len(user_ids)
+        after_id = self._last_user_id
+        for offset in range(0, len(user_ids), self.page_size):
+            page_ids = user_ids[offset:offset + self.page_size]
+            self._block_first_keys.append(first_key + offset)
+            self._block_sizes.append(len(page_ids))
+            self._block_after_ids.append(after_id)
+            after_id = page_ids[-1]
+        self._last_user_id = after_id
+        keys = range(first_key, first_key + len(user_ids))
+        self._key_user_ids.update(zip(keys, user_ids))
+
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(user_ids) - 1)
+        self._order.extend(keys)
+        self.endInsertRows()
+
+    def match_rows(self, group: "ConditionGroup", first: int = 0, count: int = None) -> np.ndarray:
+        """
+        Не все строки загружены, поэтому сохраненные строки проверяются по базе
+        (ConditionGroup.select_ids с кэшем фильтров), а измененные и новые - по значениям в памяти.
+        """
+        keys = self._order[first:None if count is None else first + count]
+        slots = self._data.slots(keys)
+        user_ids = np.fromiter(map(self._key_user_ids.get, keys, repeat(0)), dtype=np.int64, count=len(keys))
+        loaded = slots >= 0
+        user_ids[loaded] = self._data.store.user_ids(slots[loaded])
+        matched = np.fromiter(group.select_ids(self.user_manager), dtype=np.int64)
+        mask = np.isin(user_ids, matched)
+
+        changed = np.flatnonzero(np.isin(np.array(keys, dtype=np.int64), list(self._data.changed_keys())))
+        if len(changed):
+            mask[changed] = group.to_predicate()(self._data.store, slots[changed])
+        return first + np.flatnonzero(mask)
+
+    def row_data(self, row) -> dict | None:
+        key = self.row_key(row)
+        if key is None:
+            return None
+        block = self._block_of(key)
+        if key not in self._data:
+            self._load_block(block)
+        if block is not None and block in self._loaded_blocks:
+            self._loaded_blocks.move_to_end(block)
+        return self._data.get(key)
+
+    def _block_of(self, key):
+        block = bisect_right(self._block_first_keys, key) - 1
+        if block < 0 or key >= self._block_first_keys[block] + self._block_sizes[block]:
+            return None  # Строка добавлена пользователем и не относится к блокам из базы
+        return block
+
+    def _block_keys(self, block) -> range:
+        first_key = self._block_first_keys[block]
+        return range(first_key, first_key + self._block_sizes[block])
+
+    def _load_block(self, block):
+        if block is None:
+            return
+        page = self.user_manager.select_page(self._block_after_ids[block], self._block_sizes[block])
+        self._store_block(block, page)
+
+    def _store_block(self, block, page):
+        first_key = self._block_first_keys[block]
+        self._data.load_from_db({first_key + offset: row for offset, row in enumerate(page)})
+        self._loaded_blocks[block] = None
+        self._loaded_blocks.move_to_end(block)
+        self._evict_blocks()
+
+    def _evict_blocks(self):
+        """Вытесняет самые давние блоки, в которых нет измененных строк."""
+        for block in list(self._loaded_blocks):
+            if len(self._loaded_blocks) <= self.max_blocks:
+                break
+            if block in self._pinned_blocks or self._is_block_dirty(block):
+                continue
+            for key in self._block_keys(block):
+                del self._data[key]
+            del self._loaded_blocks[block]
+
+    def _is_block_dirty(self, block) -> bool:
+        for key in self._block_keys(block):
+            if key in self._data:
+                status = self._data.status(key)
+                if status.new or status.changed:
+                    return True
+        return False
+
+    def addRow(self):
+        row = len(self._order)
+        key = self._next_key
+        self._next_key += 1
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._data[key] = {header: "" for header in self._headers}
+        self._order.append(key)
+        self.endInsertRows()
+
+    def _remove_ranges(self, ranges):
+        # Блоки удаляемых строк больше не совпадают со страницами в базе, их нельзя вытеснять;
+        # вытесненные блоки подгружаются, чтобы знать id удаляемых пользователей
+        blocks = {self._block_of(key) for first, last in ranges for key in self._order[first:last + 1]} - {None}
+        self._pinned_blocks.update(blocks)
+        for block in blocks:
+            if block not in self._loaded_blocks:
+                self._load_block(block)
+        super()._remove_ranges(ranges)
+
+class FilterProxyModel(QAbstractProxyModel):
+    """
+    Строки UserTableModel, отфильтрованные группой условий, без запросов к базе.
+    Видимые строки - отсортированный массив позиций исходной модели, который
+    пересчитывается векторно по колонкам ColumnStore (UserTableModel.match_rows).
+    Правка ячейки не скрывает строку до следующего set_filter; добавленные в таблице
+    строки остаются видимыми, чтобы их можно было заполнить.
+    В ленивой модели перед фильтрацией добавляются все строки (LazyUserTableModel.fetch_all),
+    а сохраненные строки проверяются запросом к базе.
+    """
+    def __init__(self, model: UserTableModel):
+        super().__init__()
+        self._group = None
+        self._rows = np.arange(0)
+        self._removed = None  # Диапазон видимых строк между rowsAboutToBeRemoved и rowsRemoved
+        self._layout_keys = None  # Ключи видимых строк между layoutAboutToBeChanged и layoutChanged
+        self.setSourceModel(model)
+
+    def setSourceModel(self, model: UserTableModel):
+        super().setSourceModel(model)
+        self._model = model
+        model.modelAboutToBeReset.connect(lambda: self.beginResetModel())
+        model.modelReset.connect(self._on_model_reset)
+        model.layoutAboutToBeChanged.connect(self._on_layout_about_to_be_changed)
+        model.layoutChanged.connect(self._on_layout_changed)
+        model.dataChanged.connect(self._on_data_changed)
+        model.headerDataChanged.connect(self.headerDataChanged)
+        model.rowsAboutToBeRemoved.connect(self._on_rows_about_to_be_removed)
+        model.rowsRemoved.connect(self._on_rows_removed)
+        model.rowsInserted.connect(self._on_rows_inserted)
+        model.columnsAboutToBeInserted.connect(lambda parent, first, last: self.beginInsertColumns(QModelIndex(), first, last))
+        model.columnsInserted.connect(lambda parent, first, last: self.endInsertColumns())
+        model.columnsAboutToBeRemoved.connect(lambda parent, first, last: self.beginRemoveColumns(QModelIndex(), first, last))
+        model.columnsRemoved.connect(lambda parent, first, last: self.endRemoveColumns())
+        self._rows = self._match(0, model.rowCount())
+
+    def set_filter(self, group: "ConditionGroup | None"):
+        """Показывает только строки, подходящие под группу условий; None снимает фильтр."""
+        self._group = group
+        self.refilter()
+
+    def filter_group(self) -> "ConditionGroup | None":
+        return self._group
+
+    def refilter(self):
+        """Заново применяет фильтр ко всем строкам исходной модели."""
+        if self._group is not None and self._model.canFetchMore(QModelIndex()):
+            # Ленивая модель: строки, до которых еще не дошла прокрутка, тоже должны пройти фильтр
+            self._model.fetch_all()
+        self.beginResetModel()
+        self._rows = self._match(0, self._model.rowCount())
+        self.endResetModel()
+
+    def source_row(self, row: int) -> int:
+        """Позиция строки в исходной модели по позиции в фильтре."""
+        return int(self._rows[row])
+
+    def source_rows(self, rows) -> list[int]:
+        """Позиции строк в исходной модели для набора позиций в фильтре."""
+        return self._rows[np.fromiter(rows, dtype=np.int64)].tolist()
+
+    def _match(self, first: int, count: int) -> np.ndarray:
+        if self._group is None:
+            return np.arange(first, first + count)
+        return self._model.match_rows(self._group, first, count)
+
+    def _on_model_reset(self):
+        self._rows = self._match(0, self._model.rowCount())
+        self.endResetModel()
+        if self._group is not None and self._model.canFetchMore(QModelIndex()):
+            self._model.fetch_all()  # Остальные строки ленивой модели придут через rowsInserted
+
+    def _on_layout_about_to_be_changed(self, parents=None, hint=None):
+        self.layoutAboutToBeChanged.emit()
+        self._layout_keys = self._model.row_keys(self._rows)
+
+    def _on_layout_changed(self, parents=None, hint=None):
+        """
+        Сортировка или удаление строк одним layoutChanged: видимыми остаются те же строки
+        (в том числе измененные и добавленные), меняются только их позиции.
+        """
+        keys, self._layout_keys = self._layout_keys, None
+        if keys is None:
+            self.refilter()  # layoutChanged без layoutAboutToBeChanged
+            return
+        rows = self._model.key_rows(keys)
+        kept = np.flatnonzero(rows >= 0)
+        kept = kept[np.argsort(rows[kept], kind='stable')]
+        positions = np.full(len(rows), -1, dtype=np.int64)  # Старая позиция в фильтре -> новая
+        positions[kept] = np.arange(len(kept))
+        self._rows = rows[kept]
+        persistent = self.persistentIndexList()
+        if persistent:
+            self.changePersistentIndexList(persistent, [
+                self.index(int(positions[index.row()]), index.column()) if positions[index.row()] >= 0 else QModelIndex()
+                for index in persistent])
+        self.layoutChanged.emit()
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()):
+        first, last = np.searchsorted(self._rows, (top_left.row(), bottom_right.row() + 1))
+        if first < last:
+            self.dataChanged.emit(self.index(int(first), top_left.column()),
+                                  self.index(int(last) - 1, bottom_right.column()), roles)
+
+    def _on_rows_about_to_be_removed(self, parent, first, last):
+        first, last = np.searchsorted(self._rows, (first, last + 1))
+        self._removed = (int(first), int(last))
+        if first < last:
+            self.beginRemoveRows(QModelIndex(), int(first), int(last) - 1)
+
+    def _on_rows_removed(self, parent, first, last):
+        start, end = self._removed
+        self._removed = None
+        tail = self._rows[end:] - (last - first + 1)
+        self._rows = np.concatenate([self._rows[:start], tail])
+        if start < end:
+            self.endRemoveRows()
+
+    def _on_rows_inserted(self, parent, first, last):
+        count = last - first + 1
+        rows = self._match(first, count)
+        if self._group is not None:
+            rows = np.union1d(rows, self._model.new_rows(first, count)).astype(np.int64)
+        position = int(np.searchsorted(self._rows, first))
+        tail = self._rows[position:] + count
+        if not len(rows):
+            self._rows = np.concatenate([self._rows[:position], tail])
+            return
+        self.beginInsertRows(QModelIndex(), position, position + len(rows) - 1)
+        self._rows = np.concatenate([self._rows[:position], rows, tail])
+        self.endInsertRows()
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QModelIndex()
+        return self._model.index(int(self._rows[proxy_index.row()]), proxy_index.column())
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QModelIndex()
+        row = int(np.searchsorted(self._rows, source_index.row()))
+        if row < len(self._rows) and self._rows[row] == source_index.row():
+            return self.index(row, source_index.column())
+        return QModelIndex()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self._rows)) or not (0 <= column < self._model.columnCount()):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._model.columnCount()
+
+    def data(self, index, role=DISPLAY_ROLE):
+        row = index.row()
+        if row < 0 or row >= len(self._rows):
+            return None
+        return self._model.cell_data(int(self._rows[row]), index.column(), role)
+
+    def flags(self, index):
+        return ITEM_FLAGS if index.isValid() else NO_ITEM_FLAGS  # Как в UserTableModel: флаги не зависят от ячейки
+
+    def headerData(self, section, orientation, role=DISPLAY_ROLE):
+        if orientation != HORIZONTAL and 0 <= section < len(self._rows):
+            section = int(self._rows[section])  # Номера строк как в исходной таблице
+        return self._model.headerData(section, orientation, role)
+
+def format_number(number: float) -> str:
+    """Текстовый вид числа из числовой колонки: целые без дробной части."""
+    if number.is_integer() and abs(number) < 1e15:
+        return str(int(number))
+    return repr(number)
+
+# Локали без правил сравнения: strxfrm в них сравнивает коды символов ("Ё" раньше "А", заглавные раньше строчных)
+PLAIN_LOCALES = {"C", "POSIX", "C.UTF-8", "C.utf8"}
+
+def set_collation_locale() -> bool:
+    """
+    Включает сравнение строк по правилам локали пользователя (LC_COLLATE), при ее отсутствии - ru_RU.
+    Возвращает False, если подходящей локали в системе нет.
+    """
+    for name in ("", "ru_RU.UTF-8"):
+        try:
+            locale.setlocale(locale.LC_COLLATE, name)
+        except locale.Error:
+            continue
+        if locale.setlocale(locale.LC_COLLATE) not in PLAIN_LOCALES:
+            return True
+    return False
+
+def parse_number(value):
+    """Число для числовой колонки или None, если значение нельзя хранить числом без потери текста."""
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        # Текст должен восстанавливаться из числа один в один ("057" или "1e3" остаются текстом)
+        return number if isfinite(number) and format_number(number) == value else None
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and isfinite(value):
+        return float(value)
+    return None
+
+class ColumnStore:
+    """
+    Колоночное хранилище строк таблицы: по одному столбцу на атрибут вместо словаря на строку.
+    Числовые колонки хранятся в массивах NumPy (NaN - пустое значение),
+    остальные - списками с интернированными строками, id пользователей - в массиве int64.
+    Строка адресуется номером слота; освобожденные слоты используются повторно.
+    """
+    def __init__(self):
+        self._columns = {}  # header -> list | np.ndarray
+        self._user_ids = np.zeros(0, dtype=np.int64)  # 0 - пользователь еще не создан
+        self._capacity = 0
+        self._size = 0  # Число выделенных слотов, включая освобожденные
+        self._free = []
+        # Векторные копии колонок для numbers() и text_codes(); сбрасываются при записи в колонку
+        self._number_cache = {}
+        self._text_cache = {}  # header -> (коды текстов по слотам, список различных текстов)
+        self._collation_keys = {}
+
+    def headers(self) -> list:
+        return list(self._columns)
+
+    def is_numeric(self, header) -> bool:
+        return isinstance(self._columns.get(header), np.ndarray)
+
+    def allocate(self, count: int = 1) -> list[int]:
+        """Выделяет count пустых слотов."""
+        self._invalidate()
+        slots = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        count -= len(slots)
+        if count:
+            first = self._size
+            self._size += count
+            self._reserve(self._size)
+            for column in self._columns.values():
+                if isinstance(column, list):
+                    column.extend([None] * count)
+            slots.extend(range(first, self._size))
+        return slots
+
+    def release(self, slot):
+        """Освобождает слот и очищает его значения."""
+        self._invalidate()
+        for column in self._columns.values():
+            column[slot] = np.nan if isinstance(column, np.ndarray) else None
+        self._user_ids[slot] = 0
+        self._free.append(slot)
+
+    def load(self, rows: list) -> list[int]:
+        """Записывает строки-словари пачкой и возвращает их слоты; тип новых колонок определяется по данным."""
+        slots = self.allocate(len(rows))
+        values = defaultdict(list)
+        for slot, row in zip(slots, rows):
+            for header, value in row.items():
+                if header == 'user_id':
+                    self._user_ids[slot] = value or 0
+                elif value is not None:
+                    values[header].append((slot, value))
+
+        for header, cells in values.items():
+            if header not in self._columns:
+                self._create_column(header, (value for _, value in cells))
+            column = self._columns[header]
+            if isinstance(column, np.ndarray):
+                numbers = [np.nan if value == "" else parse_number(value) for _, value in cells]
+                if None in numbers:
+                    column = self._to_text(header)
+                else:
+                    column[[slot for slot, _ in cells]] = numbers
+                    continue
+            for slot, value in cells:
+                column[slot] = sys.intern(value) if isinstance(value, str) else value
+        return slots
+
+    def get(self, slot, header):
+        """Значение ячейки или None."""
+        if header == 'user_id':
+            return int(self._user_ids[slot]) or None
+        column = self._columns.get(header)
+        if column is None:
+            return None
+        value = column[slot]
+        if isinstance(column, np.ndarray):
+            return None if value != value else format_number(float(value))
+        return value
+
+    def rows(self, slots: list) -> list[dict]:
+        """Строки-словари для списка слотов; значения читаются поколоночно."""
+        rows = [{} for _ in slots]
+        for row, user_id in zip(rows, self._user_ids[slots].tolist()):
+            if user_id:
+                row['user_id'] = user_id
+        for header, column in self._columns.items():
+            if isinstance(column, np.ndarray):
+                values = [None if value != value else format_number(value) for value in column[slots].tolist()]
+            else:
+                values = [column[slot] for slot in slots]
+            for row, value in zip(rows, values):
+                if value is not None:
+                    row[header] = value
+        return rows
+
+    def set_user_ids(self, slots: list, user_ids: list):
+        self._user_ids[slots] = user_ids
+
+    def user_ids(self, slots: np.ndarray) -> np.ndarray:
+        """id пользователей в слотах; 0 - строка еще не сохранена."""
+        return self._user_ids[slots]
+
+    def display(self, slot, header) -> str:
+        """Текст ячейки для отображения; пустая ячейка - пустая строка."""
+        value = self.get(slot, header)
+        return "" if value is None else str(value)
+
+    def set(self, slot, header, value):
+        if header == 'user_id':
+            self._user_ids[slot] = value or 0
+            return
+        self._invalidate(header)
+        if header not in self._columns:
+            if value is None:
+                return
+            self._create_column(header, (value,))
+        column = self._columns[header]
+        if isinstance(column, np.ndarray):
+            if value is None or value == "":
+                column[slot] = np.nan
+                return
+            number = parse_number(value)
+            if number is not None:
+                column[slot] = number
+                return
+            column = self._to_text(header)
+        column[slot] = sys.intern(value) if isinstance(value, str) else value
+
+    def normalize(self, header, value):
+        """Значение в том виде, в котором его вернет get после set."""
+        if header != 'user_id' and self.is_numeric(header):
+            if value is None or value == "":
+                return None
+            number = parse_number(value)
+            return value if number is None else format_number(number)
+        return value
+
+    def add_column(self, header, value=None):
+        """Добавляет колонку и заполняет занятые слоты значением value."""
+        if header in self._columns:
+            return
+        self._columns[header] = [value] * self._size
+        for slot in self._free:
+            self._columns[header][slot] = None
+
+    def remove_column(self, header):
+        self._columns.pop(header, None)
+        self._invalidate(header)
+
+    def numbers(self, header) -> np.ndarray:
+        """
+        Колонка числами по всем слотам (NaN для пустых и нечисловых) для векторных операций.
+        Для числовой колонки возвращается сам массив без копирования. Текст переводится в числа
+        как attribute_num в базе (numeric_value: "75,5", " 70", "80.0"), чтобы фильтр в памяти
+        совпадал с SQL; parse_number решает только, можно ли хранить колонку числами.
+        """
+        column = self._columns.get(header)
+        if column is None:
+            return np.full(self._size, np.nan)
+        if isinstance(column, np.ndarray):
+            return column[:self._size]
+        if header not in self._number_cache:
+            numbers = (numeric_value(value) for value in column)
+            self._number_cache[header] = np.fromiter(
+                (np.nan if number is None else number for number in numbers), dtype=float, count=self._size)
+        return self._number_cache[header]
+
+    def text_codes(self, header) -> tuple[np.ndarray, list]:
+        """
+        Тексты колонки по всем слотам (пустая строка для пустых) как коды: values[codes[slot]].
+        В кэше 4 байта на слот и по одной строке на различный текст, а не копия фиксированной ширины.
+        """
+        cached = self._text_cache.get(header)
+        if cached is None:
+            index = {}
+            codes = np.fromiter((index.setdefault(self.display(slot, header), len(index)) for slot in range(self._size)),
+                                dtype=np.int32, count=self._size)
+            cached = self._text_cache[header] = (codes, list(index))
+        return cached
+
+    def texts(self, header, slots: np.ndarray) -> np.ndarray:
+        """Тексты ячеек для слотов slots (пустая строка для пустых) в виде массива NumPy."""
+        codes, values = self.text_codes(header)
+        return np.array(values, dtype=str)[codes[slots]]
+
+    def argsort(self, header, slots: np.ndarray, descending: bool = False) -> np.ndarray:
+        """
+        Устойчивый порядок позиций slots по значениям колонки: числа по величине и текст
+        по правилам локали (locale.strxfrm, LC_COLLATE); пустые ячейки в конце.
+        """
+        column = self._columns.get(header)
+        if column is None:
+            return np.arange(len(slots))
+        sign = -1 if descending else 1
+        numbers = self.numbers(header)[slots]
+        if isinstance(column, np.ndarray):
+            return np.argsort(sign * numbers, kind='stable')  # NaN (пустые) остаются в конце
+
+        codes, values = self.text_codes(header)
+        inverse = codes[slots]
+        collated = sorted(range(len(values)), key=[self.collation_key(text) for text in values].__getitem__)
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[collated] = np.arange(len(values))
+        empty = values.index("") if "" in values else -1
+        # Как в Excel: числа, затем текст (по убыванию наоборот), пустые всегда в конце;
+        # последний ключ lexsort - главный
+        kind = np.where(inverse == empty, 2, np.where(np.isnan(numbers), 1, 0))
+        if descending:
+            kind = np.where(kind == 2, 2, 1 - kind)
+        return np.lexsort((sign * ranks[inverse], sign * numbers, kind))
+
+    def collation_key(self, text: str) -> str:
+        """
+        Ключ сравнения строки по правилам локали; вычисляется один раз на строку.
+        Без локали с правилами сравнения - без учета регистра и с "ё" как "е", затем по самой строке.
+        """
+        key = self._collation_keys.get(text)
+        if key is None:
+            if locale.setlocale(locale.LC_COLLATE) in PLAIN_LOCALES:
+                key = text.casefold().replace("ё", "е") + "\0" + text
+            else:
+                key = locale.strxfrm(text)
+            self._collation_keys[text] = key
+        return key
+
+    def _invalidate(self, header=None):
+        """Сбрасывает векторные копии колонки header или всех колонок."""
+        if header is None:
+            self._number_cache.clear()
+            self._text_cache.clear()
+        else:
+            self._number_cache.pop(header, None)
+            self._text_cache.pop(header, None)
+
+    def _create_column(self, header, values):
+        """Создает колонку: числовую, если все непустые значения можно хранить числами."""
+        values = [value for value in values if value != ""]
+        if values and all(parse_number(value) is not None for value in values):
+            column = np.full(self._capacity, np.nan)
+        else:
+            column = [None] * self._size
+        self._columns[header] = column
+
+    def _to_text(self, header) -> list:
+        """Переводит числовую колонку в текстовую, когда в нее попадает не число."""
+        column = [sys.intern(format_number(float(value))) if value == value else None
+                  for value in self._columns[header][:self._size]]
+        self._columns[header] = column
+        return column
+
+    def _reserve(self, size: int):
+        if size <= self._capacity:
+            return
+        capacity = max(size, self._capacity * 2, 1024)
+        self._user_ids = np.concatenate([self._user_ids, np.zeros(capacity - self._capacity, dtype=np.int64)])
+        for header, column in self._columns.items():
+            if isinstance(column, np.ndarray):
+                self._columns[header] = np.concatenate([column, np.full(capacity - self._capacity, np.nan)])
+        self._capacity = capacity
+
+class RowView(MutableMapping):
+    """Легкий словарь-представление одной строки ColumnStore; создается по требованию."""
+    __slots__ = ('_store', '_slot')
+
+    def __init__(self, store: ColumnStore, slot: int):
+        self._store = store
+        self._slot = slot
+
+    def __getitem__(self, header):
+        value = self._store.get(self._slot, header)
+        if value is None:
+            raise KeyError(header)
+        return value
+
+    def get(self, header, default=None):
+        value = self._store.get(self._slot, header)
+        return default if value is None else value
+
+    def __setitem__(self, header, value):
+        self._store.set(self._slot, header, value)
+
+    def __delitem__(self, header):
+        self._store.set(self._slot, header, None)
+
+    def __iter__(self):
+        return (header for header in ['user_id', *self._store.headers()] if self._store.get(self._slot, header) is not None)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
 class ObservableDict(dict):
-    """Словарь, который отслеживает изменения и статусы элементов."""
+    """Словарь, который отслеживает изменения и статусы элементов; строки хранятся в ColumnStore."""
     def __init__(self):
-        self._internal_data = {}
+        self._store = ColumnStore()
+        self._slots = {}  # key -> слот строки в ColumnStore
         self._status_manager = StatusManager()
+        # Исходные значения измененных ячеек строк из базы: {key: {header: value}};
+        # ключи вложенного словаря и есть набор "грязных" ячеек строки
+        self._originals = {}
 
     @property
     def data(self):
-        return self._internal_data if self._internal_data else {}
+        return self.copy()
     
     @data.setter
     def data(self, var: dict | tuple):
@@ -296,25 +1352,24 @@ class ObservableDict(dict):
     # Новый метод для загрузки данных из словаря
     def load_from_dict(self, input_dict):
         """Загружает данные из переданного словаря и устанавливает статусы."""
-        for key, value in input_dict.items():
-            self[key] = value  # Используем __setitem__ для обновления статусов
-            status = self._status_manager.get_status(key)
-            status.exist = True
-            status.new = False
-            status.changed = False
+        self.load_from_db(input_dict)
 
     def load_from_db(self, data_from_db):
         """
         Загружает данные из базы данных и устанавливает статусы.
         :param data_from_db: Словарь с данными из базы данных.
         """
-        for key, value in data_from_db.items():
-            self[key] = value  # Используем __setitem__ для обновления статусов
+        for key in data_from_db:
+            if key in self._slots:
+                self._store.release(self._slots.pop(key))
+        slots = self._store.load(list(data_from_db.values()))
+
+        loaded_status = Status(new=False, changed=False, exist=True)
+        for key, slot in zip(data_from_db, slots):
+            self._slots[key] = slot
             # Устанавливаем статусы для существующих данных
-            status = self._status_manager.get_status(key)
-            status.exist = True
-            status.new = False
-            status.changed = False
+            self._originals.pop(key, None)
+            self._status_manager.update_status(key, loaded_status)
 
     def update_status(self, key, new_status):
         """Обновляет статус для одного элемента."""
@@ -331,69 +1386,450 @@ class ObservableDict(dict):
         """Получает статус для указанного ключа."""
         return self._status_manager.get_status(key)
 
+    def changed_keys(self) -> set:
+        """Ключи измененных элементов."""
+        return self._status_manager.changed_keys()
+
+    def cell(self, key, header):
+        """Значение ячейки или None, без создания представления строки."""
+        slot = self._slots.get(key)
+        return None if slot is None else self._store.get(slot, header)
+
+    def display_row(self, key, headers) -> list[str] | None:
+        """Тексты ячеек строки в порядке headers."""
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        return [self._store.display(slot, header) for header in headers]
+
+    def set_cell(self, key, header, value) -> bool:
+        """
+        Изменяет одну ячейку строки на месте, без копирования строки.
+        Для строки из базы запоминает исходное значение ячейки; возврат к нему снимает отметку.
+        Возвращает True, если значение изменилось.
+        """
+        slot = self._slots[key]
+        current = self._store.get(slot, header)
+        value = self._store.normalize(header, value)
+        if current == value:
+            return False
+
+        status = self._status_manager.get_status(key)
+        if not status.new:
+            originals = self._originals.setdefault(key, {})
+            if header not in originals:
+                originals[header] = current
+            elif originals[header] == value:
+                del originals[header]
+            if not originals:
+                del self._originals[key]
+        self._store.set(slot, header, value)
+        self._update_changed(key, status)
+        return True
+
+    def dirty_cells(self, key) -> dict:
+        """Измененные ячейки строки из базы: {header: исходное значение}."""
+        return self._originals.get(key, {})
+
+    def mark_saved(self, key, cells: dict):
+        """
+        Отмечает ячейки как записанные в базу.
+        Ячейка, измененная во время сохранения, остается грязной с сохраненным значением в качестве исходного.
+        """
+        slot = self._slots[key]
+        originals = self._originals.setdefault(key, {})
+        for header, value in cells.items():
+            if self._store.get(slot, header) == self._store.normalize(header, value):
+                originals.pop(header, None)
+            else:
+                originals[header] = value
+        if not originals:
+            del self._originals[key]
+        self._update_changed(key, self._status_manager.get_status(key))
+
+    def _update_changed(self, key, status):
+        status.changed = status.new or key in self._originals
+        self._status_manager.update_status(key, status)
+
+    def user_id(self, key):
+        return self.cell(key, 'user_id')
+
+    def rows(self, keys) -> dict:
+        """Снимок строк {key: dict} для списка ключей одним проходом по колонкам."""
+        keys = [key for key in keys if key in self._slots]
+        return dict(zip(keys, self._store.rows([self._slots[key] for key in keys])))
+
+    def add_rows(self, keys, rows: list[dict]):
+        """Добавляет новые строки пачкой; они отмечаются новыми и измененными, чтобы попасть в сохранение."""
+        new_status = Status(new=True, changed=True, exist=True)
+        for key, slot in zip(keys, self._store.load(rows)):
+            self._slots[key] = slot
+            self._status_manager.update_status(key, new_status)
+
+    def slots(self, keys) -> np.ndarray:
+        """Слоты ColumnStore для ключей в том же порядке; для отсутствующих ключей -1."""
+        return np.fromiter(map(self._slots.get, keys, repeat(-1)), dtype=np.int64)
+
+    @property
+    def store(self) -> ColumnStore:
+        return self._store
+
+    def set_user_ids(self, keys, user_ids):
+        self._store.set_user_ids([self._slots[key] for key in keys], list(user_ids))
+
+    def add_column(self, header, value=None):
+        self._store.add_column(header, value)
+
+    def remove_column(self, header):
+        self._store.remove_column(header)
+        for originals in self._originals.values():
+            originals.pop(header, None)
+
     def pop(self, key, default=None):
-        return self._internal_data.pop(key, default)
+        if key not in self._slots:
+            return default
+        value = dict(self[key])
+        del self[key]
+        return value
 
     def keys(self):
         """D.keys() -> a set-like object providing a view on D's keys"""
-        return self._internal_data.keys()
+        return self._slots.keys()
+
+    def values(self):
+        return (RowView(self._store, slot) for slot in self._slots.values())
+
+    def items(self):
+        return ((key, RowView(self._store, slot)) for key, slot in self._slots.items())
 
     def copy(self) -> dict:
-        return self._internal_data.copy()
+        return {key: dict(row) for key, row in self.items()}
 
     def get(self, key: Any, default:Any=None):
-        return self._internal_data.get(key, default)
+        slot = self._slots.get(key)
+        return default if slot is None else RowView(self._store, slot)
 
     def __contains__(self, key):
         # Здесь вы можете определить свою логику
-        return key in self._internal_data
+        return key in self._slots
 
     def __getitem__(self, key: Any) -> Any:
-        return self._internal_data.__getitem__(key)
+        return RowView(self._store, self._slots[key])
 
     def __setitem__(self, key, value):
-        status = self._status_manager.get_status(key)
-        if key in self._internal_data:
-            if self._internal_data[key] != value:
-                status.changed = True
-            else:
-                status.changed = False
-        else:
-            status.new = True
+        if key in self._slots:
+            # Существующая строка обновляется по ячейкам, чтобы отслеживать каждую из них
+            for header, cell_value in value.items():
+                self.set_cell(key, header, cell_value)
+            return
 
+        status = self._status_manager.get_status(key)
+        status.new = True
         # Устанавливаем exist в True, так как элемент добавляется
         status.exist = True
 
-        self._internal_data[key] = value
+        self._slots[key] = self._store.load([value])[0]
         self._status_manager.update_status(key, status)
 
     def __delitem__(self, key):
-        if key in self._internal_data:
-            del self._internal_data[key]
+        if key in self._slots:
+            self._store.release(self._slots.pop(key))
             # Удаляем статус элемента
             self._status_manager.remove_status(key)
+            self._originals.pop(key, None)
 
     def __len__(self) -> int:
-        return len(self._internal_data)
+        return len(self._slots)
 
     def __repr__(self):
-        return f'{self._internal_data}'
+        return f'{self.copy()}'
+
+class ConditionGroup:
+    """
+    Группа условий: атрибут -> диапазон (min, max), None - граница не задана.
+    Границы разбираются один раз при создании: числа в float, даты в строку ГГГГ-ММ-ДД.
+    Группа компилируется в параметризованный запрос UserManager (to_sql/select)
+    и в векторный предикат по загруженной таблице (to_predicate).
+    """
+    __slots__ = ('name', 'ranges')
+
+    # Ключ условия по дате рождения в UserManager.build_query и колонка даты в строках
+    DATE_KEY = "date"
+    DATE_HEADER = "date_of_birth"
+
+    def __init__(self, name: str, ranges: dict):
+        self.name = name
+        self.ranges = ranges
+
+    @classmethod
+    def from_inputs(cls, name: str, conditions: dict) -> "ConditionGroup":
+        """
+        Группа из текстов полей ввода {attribute: (from_text, to_text)}.
+        Атрибуты с обоими пустыми полями пропускаются; неверное значение вызывает ValueError.
+        """
+        ranges = {}
+        for attribute, texts in conditions.items():
+            low, high = (cls.parse_bound(attribute, text) for text in texts)
+            if low is not None or high is not None:
+                ranges[attribute] = (low, high)
+        return cls(name, ranges)
+
+    @classmethod
+    def parse_bound(cls, attribute: str, text: str):
+        text = text.strip()
+        if not text:
+            return None
+        if attribute in (cls.DATE_KEY, cls.DATE_HEADER):
+            try:
+                return datetime.strptime(text, "%Y-%m-%d").strftime("%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"{attribute}: ожидается дата ГГГГ-ММ-ДД, получено {text!r}")
+        try:
+            number = float(text.replace(',', '.'))
+        except ValueError:
+            raise ValueError(f"{attribute}: ожидается число, получено {text!r}")
+        if not isfinite(number):
+            raise ValueError(f"{attribute}: ожидается конечное число, получено {text!r}")
+        return number
+
+    def texts(self) -> dict:
+        """Тексты границ для полей ввода {attribute: (from_text, to_text)}."""
+        return {attribute: tuple("" if bound is None else format_number(bound) if isinstance(bound, float) else bound
+                                 for bound in bounds)
+                for attribute, bounds in self.ranges.items()}
+
+    def filter_attributes(self) -> dict:
+        """Условия в формате UserManager.select_on_filter: {attribute: {"min": ..., "max": ...}}."""
+        return {self.DATE_KEY if attribute == self.DATE_HEADER else attribute: {"min": low, "max": high}
+                for attribute, (low, high) in self.ranges.items()}
+
+    def to_sql(self, user_manager: UserManager) -> tuple[str, list]:
+        """Параметризованный запрос id подходящих пользователей (план из реестра запросов Database)."""
+        return user_manager.build_query(self.filter_attributes())
+
+    def select(self, user_manager: UserManager) -> dict:
+        """Подходящие пользователи из базы в формате select_all."""
+        return user_manager.select_on_filter(self.filter_attributes())
+
+    def select_ids(self, user_manager: UserManager) -> frozenset:
+        """Id подходящих пользователей из базы; повторное применение группы берет их из кэша фильтров."""
+        return user_manager.select_ids_on_filter(self.filter_attributes())
+
+    def to_predicate(self):
+        """
+        Векторный предикат predicate(store, slots) -> np.ndarray[bool] по строкам ColumnStore в слотах slots.
+        Как и в SQL, пустое или нечисловое значение условию не удовлетворяет.
+        """
+        conditions = self.conditions()
+
+        def predicate(store: ColumnStore, slots: np.ndarray) -> np.ndarray:
+            mask = np.ones(len(slots), dtype=bool)
+            for header, low, high in conditions:
+                values, missing = self.column_values(store, header, slots)
+                mask &= ~missing
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values <= high
+            return mask
+        return predicate
+
+    def conditions(self) -> list[tuple]:
+        """Условия в виде (колонка строк таблицы, min, max)."""
+        return [(self.DATE_HEADER if attribute == self.DATE_KEY else attribute, low, high)
+                for attribute, (low, high) in self.ranges.items()]
+
+    @classmethod
+    def column_values(cls, store: ColumnStore, header, slots: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Значения колонки для сравнения с границами и маска пустых: даты строками, остальное числами."""
+        if header == cls.DATE_HEADER:
+            values = store.texts(header, slots)
+            return values, values == ""
+        values = store.numbers(header)[slots]
+        return values, np.isnan(values)
+
+    def __str__(self):
+        conditions = ", ".join(f"{attribute} {low or '…'}–{high or '…'}" for attribute, (low, high) in self.texts().items())
+        return f"{self.name}: {conditions}"
+
+class GroupClassifier:
+    """
+    Распределение спортсменов сразу по всем группам условий за один проход.
+    Для каждого атрибута границы всех групп сортируются; значение находится среди них
+    через np.searchsorted (O(log g)) и попадает в ячейку - точку-границу или интервал
+    между соседними границами. Для каждой ячейки заранее известен набор подходящих групп
+    в виде битовой маски, поэтому принадлежность группам - это AND масок ячеек по атрибутам.
+    """
+    def __init__(self, groups: list[ConditionGroup]):
+        self.groups = list(groups)
+        bounds = defaultdict(list)
+        for number, group in enumerate(self.groups):
+            for header, low, high in group.conditions():
+                bounds[header].append((number, low, high))
+        # header -> (отсортированные границы, битовые маски групп по ячейкам)
+        self._attributes = {header: self._compile(attribute_bounds) for header, attribute_bounds in bounds.items()}
+
+    def _compile(self, bounds: list[tuple]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Ячейки атрибута для k границ b: 2i - интервал перед b[i] (2k - после последней),
+        2i + 1 - сама граница b[i], 2k + 1 - пустое значение.
+        """
+        points = sorted({bound for _, low, high in bounds for bound in (low, high) if bound is not None})
+        position = {point: index for index, point in enumerate(points)}
+        cells = np.ones((2 * len(points) + 2, len(self.groups)), dtype=bool)
+        for number, low, high in bounds:
+            first = 0 if low is None else 2 * position[low] + 1
+            last = 2 * len(points) if high is None else 2 * position[high] + 1
+            cells[:, number] = False
+            cells[first:last + 1, number] = True
+        return np.array(points), np.packbits(cells, axis=1, bitorder='little')
+
+    def _packed_membership(self, store: ColumnStore, slots: np.ndarray) -> np.ndarray:
+        """Принадлежность группам по строкам: бит группы number в байте number // 8."""
+        membership = np.full((len(slots), (len(self.groups) + 7) // 8), 0xFF, dtype=np.uint8)
+        for header, (points, cells) in self._attributes.items():
+            values, missing = ConditionGroup.column_values(store, header, slots)
+            index = np.searchsorted(points, values) if len(points) else np.zeros(len(slots), dtype=np.int64)
+            exact = np.zeros(len(slots), dtype=bool)
+            inside = index < len(points)
+            exact[inside] = points[index[inside]] == values[inside]
+            cell = 2 * index + exact
+            cell[missing] = 2 * len(points) + 1
+            membership &= cells[cell]
+        return membership
+
+    def membership(self, store: ColumnStore, slots: np.ndarray) -> np.ndarray:
+        """Матрица принадлежности [строка, группа] для строк ColumnStore в слотах slots."""
+        packed = self._packed_membership(store, np.asarray(slots, dtype=np.int64))
+        return np.unpackbits(packed, axis=1, count=len(self.groups), bitorder='little').astype(bool)
+
+    def classify(self, store: ColumnStore, slots: np.ndarray) -> dict[ConditionGroup, np.ndarray]:
+        """Группа -> id подходящих пользователей; строки без id (еще не сохраненные) пропускаются."""
+        slots = np.asarray(slots, dtype=np.int64)
+        membership = self._packed_membership(store, slots)
+        user_ids = store.user_ids(slots)
+        saved = user_ids != 0
+        return {group: user_ids[(membership[:, number // 8] & (1 << number % 8) != 0) & saved]
+                for number, group in enumerate(self.groups)}
+
+    def classify_users(self, user_manager: UserManager) -> dict[ConditionGroup, np.ndarray]:
+        """Распределяет по группам всех пользователей из базы (даты рождения читаются отдельно)."""
+        rows = list(user_manager.iter_users())
+        if ConditionGroup.DATE_HEADER in self._attributes:
+            dates = user_manager.dates_of_birth()
+            for row in rows:
+                row[ConditionGroup.DATE_HEADER] = dates.get(row['user_id'])
+        store = ColumnStore()
+        return self.classify(store, store.load(rows))
 
 class ConditionManager:
     def __init__(self):
-        self.groups = []
+        self.groups: list[ConditionGroup] = []
 
-    def add_group(self, group_name, conditions):
-        group_info = f"{group_name}: {conditions}"
-        self.groups.append(group_info)
+    def add_group(self, group_name, conditions) -> ConditionGroup:
+        """conditions: тексты полей ввода {attribute: (from_text, to_text)}; ValueError при неверном значении."""
+        group = ConditionGroup.from_inputs(group_name, conditions)
+        self.groups.append(group)
+        return group
 
     def edit_group(self, index, group_name, conditions):
         if 0 <= index < len(self.groups):
-            self.groups[index] = f"{group_name}: {conditions}"
+            self.groups[index] = ConditionGroup.from_inputs(group_name, conditions)
 
-    def get_groups(self):
+    def get_groups(self) -> list[ConditionGroup]:
         return self.groups
 
+    def classifier(self) -> GroupClassifier:
+        """Классификатор по всем текущим группам."""
+        return GroupClassifier(self.groups)
+
+class DatabaseWorker(QObject):
+    """Выполняет задания с базой данных в фоновом потоке через собственное соединение."""
+    finished = Signal(int, object)
+    failed = Signal(int, str)
+    progress = Signal(int, int, int)  # job_id, выполнено, всего
+
+    def __init__(self, db_name: str):
+        super().__init__()
+        self.db_name = db_name
+        self.db = None
+        self.user_manager = None
+        self.attribute_manager = None
+
+    @Slot(int, object)
+    def run_job(self, job_id, job):
+        # Соединение SQLite создается в потоке, в котором будет использоваться
+        if self.db is None:
+            self.db = Database(self.db_name)
+            self.user_manager = UserManager(self.db)
+            self.attribute_manager = AttributeManager(self.db)
+        try:
+            result = job(self.user_manager, self.attribute_manager,
+                         lambda done, total=0: self.progress.emit(job_id, done, total))
+        except Exception as e:
+            self.failed.emit(job_id, str(e))
+            return
+        self.finished.emit(job_id, result)
+
+    @Slot()
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+class DatabaseExecutor(QObject):
+    """
+    Очередь заданий к базе данных, выполняемых по одному в отдельном QThread.
+    Задание: job(user_manager, attribute_manager, progress) -> result;
+    результат, ошибка и прогресс приходят в поток интерфейса через сигналы.
+    """
+    _submit = Signal(int, object)
+
+    def __init__(self, db_name: str):
+        super().__init__()
+        self._callbacks = {}
+        self._next_job_id = 0
+
+        self._thread = QThread()
+        self._worker = DatabaseWorker(db_name)
+        self._worker.moveToThread(self._thread)
+        self._submit.connect(self._worker.run_job)
+        self._worker.finished.connect(self._on_finished)
+        self._worker.failed.connect(self._on_failed)
+        self._worker.progress.connect(self._on_progress)
+        self._thread.start()
+
+    def submit(self, job, on_result=None, on_error=None, on_progress=None) -> int:
+        self._next_job_id += 1
+        job_id = self._next_job_id
+        self._callbacks[job_id] = (on_result, on_error, on_progress)
+        self._submit.emit(job_id, job)
+        return job_id
+
+    def stop(self):
+        """Закрывает соединение в фоновом потоке и останавливает поток."""
+        if self._thread.isRunning():
+            QMetaObject.invokeMethod(self._worker, "close", Qt.BlockingQueuedConnection)
+            self._thread.quit()
+            self._thread.wait()
+
+    def _on_finished(self, job_id, result):
+        on_result, _, _ = self._callbacks.pop(job_id, (None, None, None))
+        if on_result:
+            on_result(result)
+
+    def _on_failed(self, job_id, error):
+        _, on_error, _ = self._callbacks.pop(job_id, (None, None, None))
+        if on_error:
+            on_error(error)
+        else:
+            print(f"Ошибка фонового задания: {error}")
+
+    def _on_progress(self, job_id, done, total):
+        _, _, on_progress = self._callbacks.get(job_id, (None, None, None))
+        if on_progress:
+            on_progress(done, total)
+
 # Основное окно приложения
 class MainWindow(QMainWindow):
     def __init__(self, model):
@@ -447,7 +1883,7 @@ class MainWindow(QMainWindow):
         return action
 
 class ConditionGroupDialog(QDialog):
-    def __init__(self, headers, condition_manager):
+    def __init__(self, headers, condition_manager, filter_model: FilterProxyModel = None):
         super().__init__()
         self.setWindowTitle("Создать группу условий")
         self.setFixedSize(300, 300)
@@ -468,12 +1904,26 @@ class ConditionGroupDialog(QDialog):
         self.create_button = QPushButton("Создать группу", self)
         self.create_button.clicked.connect(self.create_group)
         self.layout.addWidget(self.create_button)
+        self.edited_index = None  # Номер редактируемой группы или None при создании новой
 
         # Список созданных групп
         self.groups_list = QListWidget(self)
         self.layout.addWidget(self.groups_list)
+        self.groups_list.itemDoubleClicked.connect(lambda item: self.edit_group(self.groups_list.row(item)))
         self.load_groups()
 
+        # Фильтр таблицы по выбранной группе
+        self.filter_model = filter_model
+        if filter_model is not None:
+            filter_layout = QHBoxLayout()
+            self.apply_filter_button = QPushButton("Применить фильтр", self)
+            self.apply_filter_button.clicked.connect(self.apply_filter)
+            self.reset_filter_button = QPushButton("Сбросить фильтр", self)
+            self.reset_filter_button.clicked.connect(lambda: self.filter_model.set_filter(None))
+            filter_layout.addWidget(self.apply_filter_button)
+            filter_layout.addWidget(self.reset_filter_button)
+            self.layout.addLayout(filter_layout)
+
     def _create_input_fields(self, headers):
         for header in headers:
             if headers.index(header) == 0:
@@ -491,20 +1941,48 @@ class ConditionGroupDialog(QDialog):
     def load_groups(self):
         self.groups_list.clear()
         for group in self.condition_manager.get_groups():
-            self.groups_list.addItem(group)
+            self.groups_list.addItem(str(group))
 
     def create_group(self):
         group_name = self.group_name.text()
         conditions = {header: (from_input.text(), to_input.text()) for header, (from_input, to_input) in self.inputs.items()}
-        self.condition_manager.add_group(group_name, conditions)
+        try:
+            if self.edited_index is None:
+                self.condition_manager.add_group(group_name, conditions)
+            else:
+                self.condition_manager.edit_group(self.edited_index, group_name, conditions)
+        except ValueError as e:
+            QMessageBox.warning(self, "Ошибка", str(e))
+            return
         self.load_groups()
         self.clear_inputs()
 
+    def edit_group(self, index):
+        """Заполняет поля ввода границами выбранной группы; кнопка сохраняет изменения в нее."""
+        group = self.condition_manager.get_groups()[index]
+        self.clear_inputs()
+        self.group_name.setText(group.name)
+        for header, (from_text, to_text) in group.texts().items():
+            if header in self.inputs:
+                from_input, to_input = self.inputs[header]
+                from_input.setText(from_text)
+                to_input.setText(to_text)
+        self.edited_index = index
+        self.create_button.setText("Сохранить изменения")
+
+    def apply_filter(self):
+        """Оставляет в таблице строки, подходящие под выбранную в списке группу."""
+        index = self.groups_list.currentRow()
+        if index >= 0:
+            self.filter_model.set_filter(self.condition_manager.get_groups()[index])
+
     def clear_inputs(self):
         self.group_name.clear()
         for from_input, to_input in self.inputs.values():
             from_input.clear()
             to_input.clear()
+        self.edited_index = None
+        self.create_button.setText("Создать группу")
 
 class EditDialog(QDialog):
     def __init__(self, data: dict, headers: list):
@@ -586,9 +2064,12 @@ class AddColumnDialog(QDialog):
         return self.column_name_input.text()
 
 class TableController:
-    def __init__(self, model, window):
+    def __init__(self, model, window, executor: DatabaseExecutor = None, filter_model: FilterProxyModel = None):
         self.model = model
         self.window = window
+        self.executor = executor
+        # Представление показывает строки через фильтр; позиции выделения переводятся в позиции модели
+        self.filter_model = filter_model
 
         # Подключаем действия интерфейса к методам контроллера
         self.window.add_column_action.triggered.connect(self.add_column)
@@ -602,7 +2083,33 @@ class TableController:
         self.window.save_action.triggered.connect(self.save_action)
 
     def save_action(self):
-        if self.model.save_action():
+        if self.executor is None:
+            self.show_save_result(self.model.save_action())
+            return
+
+        save_job = self.model.get_save_job()
+        if save_job is None:
+            self.show_save_result(False)
+            return
+        job, changes = save_job
+
+        # Сохранение идет в фоновом потоке, окно остается отзывчивым
+        self.window.save_action.setEnabled(False)
+        self.window.statusBar().showMessage("Сохранение...")
+        self.executor.submit(
+            job,
+            on_result=lambda user_ids: self.on_save_finished(changes, user_ids),
+            on_error=lambda error: self.on_save_finished(changes, None),
+            on_progress=lambda done, total: self.window.statusBar().showMessage(f"Сохранено {done} из {total}"),
+        )
+
+    def on_save_finished(self, changes, user_ids):
+        self.window.save_action.setEnabled(True)
+        self.window.statusBar().clearMessage()
+        self.show_save_result(self.model.finish_save(changes, user_ids))
+
+    def show_save_result(self, status: bool):
+        if status:
             self.show_message("Успех", "Данные успешно сохранены.")
         else:
             self.show_message("Ошибка", "Не удалось сохранить данные.")
@@ -626,14 +2133,23 @@ class TableController:
 
     def copy_data(self):
         if selected_indexes := self.window.table_view.selectedIndexes():
-            rows = set(index.row() for index in selected_indexes)
+            rows = self.source_rows(index.row() for index in selected_indexes)
             columns = set(index.column() for index in selected_indexes)
-            self.model.copyData(rows, columns)
+            QApplication.clipboard().setText(self.model.copyData(rows, columns))
 
     def paste_data(self):
         selected_index = self.window.table_view.currentIndex()
         if selected_index.isValid():
-            self.model.pasteData(selected_index.row(), selected_index.column())
+            row, column = self.source_row(selected_index.row()), selected_index.column()
+            # При фильтре значения вставляются в видимые строки, а не в скрытые между ними
+            rows = None
+            if self.filter_model is not None:
+                rows = self.source_rows(range(selected_index.row(), self.filter_model.rowCount()))
+            # Буфер обмена системы позволяет вставлять данные из Excel и других программ
+            if text := QApplication.clipboard().text():
+                self.model.pasteData(row, column, self.model.parse_tsv(text), rows)
+            else:
+                self.model.pasteData(row, column, rows=rows)
         self.window.table_view.clearSelection()
 
     def remove_column(self):
@@ -651,51 +2167,142 @@ class TableController:
         if not selected_indexes:
             return
 
-        rows_to_remove = sorted(set(index.row() for index in selected_indexes), reverse=True)
-        for row in rows_to_remove:
-            self.model.removeRow(row)
+        self.model.removeRowRanges(self.source_rows(index.row() for index in selected_indexes))
 
     def on_cell_double_clicked(self, index):
         if index.isValid():
-            self.model.editData(index.row())
+            self.model.editData(self.source_row(index.row()))
+
+    def source_row(self, row: int) -> int:
+        """Позиция строки в модели по позиции в представлении."""
+        return row if self.filter_model is None else self.filter_model.source_row(row)
+
+    def source_rows(self, rows) -> list[int]:
+        """Позиции строк в модели по возрастанию позиций в представлении (порядок важен для вставки)."""
+        rows = sorted(set(rows))
+        return rows if self.filter_model is None else self.filter_model.source_rows(rows)
 
 class ConditionController:
-    def __init__(self):
+    def __init__(self, filter_model: FilterProxyModel = None):
         self.condition_manager = ConditionManager()
+        self.filter_model = filter_model
 
     def open_conditions_dialog(self, headers):
-        dialog = ConditionGroupDialog(headers, self.condition_manager)
+        dialog = ConditionGroupDialog(headers, self.condition_manager, self.filter_model)
         dialog.exec()
 
 class AppController:
-    def __init__(self, db):
+    """
+    По умолчанию все строки загружаются в ColumnStore: так работают сортировка по щелчку
+    на заголовке и фильтр в памяти. lazy=True - постраничная подгрузка для баз, которые
+    не помещаются в память; в этом режиме таблица не сортируется (порядок строк - по user_id).
+    """
+    def __init__(self, db, lazy: bool = False):
         self.table_manager = TableManager(db)
         self.table_manager.create_tables()
         self.user_manager = UserManager(db)
         self.attribute_manager = AttributeManager(db)
 
-        self.data = ObservableDict()
-        data = self.user_manager.select_all()
-        self.data.load_from_db(data)
-
         self.headers = self.attribute_manager.names_all_attributes()
 
-        self.model = UserTableModel(self.headers, self.user_manager, self.attribute_manager)
-        self.model._data = self.data
+        # Фоновый поток со своим соединением; для базы в памяти второе соединение невозможно
+        self.executor = DatabaseExecutor(db.name) if db.name != ':memory:' else None
 
-        self.window = MainWindow(self.model)
+        self.lazy = lazy
+        if lazy:
+            # Строки подгружаются представлением через fetchMore по мере прокрутки
+            self.model = LazyUserTableModel(self.headers, self.user_manager, self.attribute_manager)
+        else:
+            self.model = UserTableModel(self.headers, self.user_manager, self.attribute_manager)
+            self.model.load_rows({})
+        self.data = self.model.get_data()
+        # Фильтр по группам условий считается в памяти поверх загруженных строк
+        self.filter_model = FilterProxyModel(self.model)
+
+        self.window = MainWindow(self.filter_model)
+        # Сортировка по щелчку на заголовке; ленивая модель не сортируется
+        self.window.table_view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.window.table_view.setSortingEnabled(not lazy)
         self.condition_groups = []
-        self.table_controller = TableController(self.model, self.window)
-        self.condition_controller = ConditionController()
+        self.table_controller = TableController(self.model, self.window, self.executor, self.filter_model)
+        self.condition_controller = ConditionController(self.filter_model)
 
         self.window.load_excel_action.triggered.connect(self.load_data_from_excel)
         self.window.conditions_action.triggered.connect(lambda: self.condition_controller.open_conditions_dialog(self.model.get_headers()))
 
+        if not lazy:
+            self.load_rows()
 
     def load_data_from_excel(self):
-        file_path, _ = QFileDialog.getOpenFileName(self.window, "Открыть файл Excel", "", "Excel Files (*.xlsx *.xls)")
-        if file_path:
-            self.model.loadDataFromExcel(file_path)
+        file_path, _ = QFileDialog.getOpenFileName(self.window, "Открыть файл Excel", "", "Excel Files (*.xlsx *.xlsm)")
+        if not file_path:
+            return
+        if self.model.has_changes():
+            # После импорта таблица перечитывается из базы, несохраненные правки потерялись бы
+            self.table_controller.show_message("Импорт", "Сохраните изменения перед импортом.")
+            return
+
+        if self.executor is None:
+            self.table_controller.show_message(*self.import_result(self.model.loadDataFromExcel(file_path)))
+            return
+
+        # Импорт идет в фоновом потоке со своим соединением, окно остается отзывчивым
+        self.window.load_excel_action.setEnabled(False)
+        self.window.statusBar().showMessage("Импорт...")
+        self.executor.submit(
+            lambda user_manager, attribute_manager, progress: ExcelImporter(user_manager.db).import_file(file_path, progress=progress),
+            on_result=self.on_excel_imported,
+            on_error=lambda error: self.on_excel_imported(None),
+            on_progress=lambda done, total: self.window.statusBar().showMessage(
+                f"Импортировано {done} из {total}" if total else f"Импортировано {done}"),
+        )
+
+    def on_excel_imported(self, user_ids):
+        self.window.load_excel_action.setEnabled(True)
+        self.window.statusBar().clearMessage()
+        if user_ids is not None:
+            self.model.set_headers(self.attribute_manager.names_all_attributes())
+            if self.lazy:
+                self.model.reload()
+            else:
+                self.load_rows()
+        self.table_controller.show_message(*self.import_result(user_ids))
+
+    @staticmethod
+    def import_result(user_ids) -> tuple[str, str]:
+        if user_ids is None:
+            return "Ошибка", "Не удалось импортировать файл."
+        return "Импорт", f"Импортировано спортсменов: {len(user_ids)}."
+
+    def load_rows(self):
+        """Загружает всех пользователей без блокировки окна."""
+        if self.executor is None:
+            self.model.load_rows(self.user_manager.select_all())
+            return
+        self.window.statusBar().showMessage("Загрузка...")
+
+        def job(user_manager, attribute_manager, progress):
+            rows = {}
+            for row_id, row in enumerate(user_manager.iter_users()):
+                rows[row_id] = row
+                if row_id % 10000 == 0:
+                    progress(row_id)
+            return rows
+
+        self.executor.submit(
+            job,
+            on_result=self.on_rows_loaded,
+            on_progress=lambda done, total: self.window.statusBar().showMessage(f"Загружено {done}"),
+        )
+
+    def on_rows_loaded(self, rows):
+        self.model.load_rows(rows)
+        self.data = self.model.get_data()
+        self.window.statusBar().clearMessage()
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.stop()
 
     def run(self):
         self.window.show()
@@ -724,6 +2331,7 @@ def insert_data(user_manager: UserManager, attribute_manager: AttributeManager):
         user_manager.change_attribute_value(user_id, random_height, height)
 
 def main():
+    set_collation_locale()
     db = Database('your_database.db')
     app = QApplication(sys.argv)  # Создаем экземпляр QApplication     
 
@@ -751,6 +2359,7 @@ def main():
     sys.exit(app.exec())
 
 def new_main():
+    set_collation_locale()
     db = Database('your_database.db')
 
     app = QApplication(sys.argv)  # Создаем экземпляр QApplication     
@@ -761,6 +2370,7 @@ def new_main():
     screen_geometry = first_screen.geometry()
     appController = AppController(db)
     appController.table_manager.create_tables()
+    app.aboutToQuit.connect(appController.stop)
 
     appController.window.setGeometry(screen_geometry)
     appController.window.move(screen_geometry.x(), screen_geometry.y())      